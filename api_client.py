@@ -0,0 +1,240 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from run_metrics import get_metrics
+
+API_BASE_URL = "https://de.openparliament.tv/api/v1"
+
+DEFAULT_HTTP_CACHE_DIR = "./cache/http"
+DEFAULT_FIXTURE_GLOB = "./api_data/*.json"
+
+# Seconds before a request is sent again
+DEFAULT_TIMEOUT = 30
+
+# How long a cached response stays valid per endpoint, None means it never expires.
+# Search results change when new speeches are added, media documents do not change once published
+ENDPOINT_TTL_SECONDS = {
+    "/api/v1/search/": 24 * 60 * 60,
+    "/api/v1/media/": None,
+}
+DEFAULT_TTL_SECONDS = 60 * 60
+
+# Number of requests that run at the same time, this is also the size of the connection pool
+DEFAULT_MAX_WORKERS = 8
+
+# Maximum number of requests started per second against a single host
+DEFAULT_REQUESTS_PER_SECOND = 5
+
+# Failed requests are retried with an exponential backoff, starting at DEFAULT_BACKOFF_SECONDS
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def normalise_url(url):
+    # Lower cases the scheme and host and sorts the query parameters, so equivalent urls share a cache entry
+    parsed_url = urllib.parse.urlsplit(url)
+    query_params = sorted(urllib.parse.parse_qsl(
+        parsed_url.query, keep_blank_values=True))
+    return urllib.parse.urlunsplit((parsed_url.scheme.lower(), parsed_url.netloc.lower(), parsed_url.path,
+                                    urllib.parse.urlencode(query_params), ""))
+
+
+def get_ttl_seconds(url):
+    path = urllib.parse.urlsplit(url).path
+    for endpoint_prefix, ttl_seconds in ENDPOINT_TTL_SECONDS.items():
+        if path.startswith(endpoint_prefix):
+            return ttl_seconds
+    return DEFAULT_TTL_SECONDS
+
+
+class HostRateLimiter:
+    requests_per_second = None
+
+    def __init__(self, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        self.requests_per_second = requests_per_second
+        self.__next_request_times = {}
+        self.__lock = threading.Lock()
+
+    def wait(self, url):
+        # Reserves the next free slot for the url's host and sleeps until it is reached
+        if self.requests_per_second is None:
+            return
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self.__lock:
+            now = time.monotonic()
+            request_time = max(now, self.__next_request_times.get(host, now))
+            self.__next_request_times[host] = request_time + \
+                1 / self.requests_per_second
+        time.sleep(max(0, request_time - now))
+
+
+class OpenParliamentClient:
+    api_base_url = API_BASE_URL
+    cache_dir = None
+    offline = False
+    timeout = DEFAULT_TIMEOUT
+    session = None
+    max_workers = DEFAULT_MAX_WORKERS
+    max_retries = DEFAULT_MAX_RETRIES
+    backoff_seconds = DEFAULT_BACKOFF_SECONDS
+    rate_limiter = None
+
+    def __init__(self, cache_dir=DEFAULT_HTTP_CACHE_DIR, offline=False, fixture_glob=DEFAULT_FIXTURE_GLOB,
+                 timeout=DEFAULT_TIMEOUT, session=None, api_base_url=API_BASE_URL,
+                 max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS):
+        # cache_dir can be None to disable the cache, offline mode then only serves fixtures
+        self.api_base_url = api_base_url
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.session = session if session is not None else self.__create_session(
+            max_workers)
+        self.__fixtures = self.__load_fixture_index(fixture_glob)
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_json(self, url):
+        request_start = time.perf_counter()
+        body, source = self.__get_json(url)
+        get_metrics().record_request(
+            url, time.perf_counter() - request_start, source)
+        return body
+
+    def __get_json(self, url):
+        # Returns the response body and where it came from, "cache", "fixture" or "network"
+        normalised_url = normalise_url(url)
+
+        cached_entry = self.__read_cache(normalised_url)
+        if cached_entry is not None and (self.offline or not self.__is_expired(cached_entry, url)):
+            return cached_entry["body"], "cache"
+
+        if self.offline:
+            if normalised_url in self.__fixtures:
+                return self.__fixtures[normalised_url], "fixture"
+            raise ValueError("No cached response or fixture for " +
+                             url + " in offline mode")
+
+        response = self.__get_with_retries(url)
+        body = response.json()
+        # Errors are returned to the caller as before but never cached
+        if response.ok:
+            self.__write_cache(normalised_url, body)
+        return body, "network"
+
+    def get_json_many(self, urls):
+        # Fetches all urls concurrently on the shared session, results are returned in the order of urls
+        if len(urls) <= 1 or self.max_workers <= 1:
+            return [self.get_json(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.get_json, urls))
+
+    def __get_with_retries(self, url):
+        attempt = 0
+        while True:
+            self.rate_limiter.wait(url)
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                    return response
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            time.sleep(self.backoff_seconds * 2 ** attempt)
+            attempt += 1
+
+    @staticmethod
+    def __create_session(max_workers):
+        # One pooled connection per worker, so concurrent requests to the api reuse their connections
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def __get_cache_path(self, normalised_url):
+        url_hash = hashlib.sha256(normalised_url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, url_hash + ".json.gz")
+
+    def __read_cache(self, normalised_url):
+        if self.cache_dir is None:
+            return None
+        cache_path = self.__get_cache_path(normalised_url)
+        if not os.path.exists(cache_path):
+            return None
+        with gzip.open(cache_path, "rt", encoding="utf-8") as cache_file:
+            return json.load(cache_file)
+
+    def __write_cache(self, normalised_url, body):
+        if self.cache_dir is None:
+            return
+        cache_path = self.__get_cache_path(normalised_url)
+        # Write to a temporary file first so an interrupted run never leaves a half written entry. Every write
+        # gets its own temporary file, so concurrent fetches of the same url cannot write into each other's
+        temporary_fd, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(cache_path), suffix=".tmp")
+        try:
+            with os.fdopen(temporary_fd, "wb") as temporary_file, \
+                    gzip.open(temporary_file, "wt", encoding="utf-8") as cache_file:
+                json.dump({"url": normalised_url, "fetched_at": time.time(),
+                          "body": body}, cache_file)
+            os.replace(temporary_path, cache_path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    @staticmethod
+    def __is_expired(cached_entry, url):
+        ttl_seconds = get_ttl_seconds(url)
+        if ttl_seconds is None:
+            return False
+        return time.time() - cached_entry["fetched_at"] > ttl_seconds
+
+    @staticmethod
+    def __load_fixture_index(fixture_glob):
+        # Fixtures are raw media responses, they are served under the api url in data.links.self
+        fixtures = {}
+        if fixture_glob is None:
+            return fixtures
+        for fixture_path in sorted(glob.glob(fixture_glob)):
+            with open(fixture_path, encoding="utf-8") as fixture_file:
+                fixture = json.load(fixture_file)
+            try:
+                fixture_url = fixture["data"]["links"]["self"]
+            except (KeyError, TypeError):
+                continue
+            fixtures[normalise_url(fixture_url)] = fixture
+        return fixtures
+
+
+default_client = None
+
+
+def get_default_client():
+    global default_client
+    if default_client is None:
+        default_client = OpenParliamentClient()
+    return default_client
+
+
+def set_default_client(client):
+    global default_client
+    default_client = client
@@ -0,0 +1,202 @@
+# Checks and times OpenParliamentClient against a local stand-in for the media api, serving the api_data fixture.
+# Covers the result order of get_json_many, retries of failed responses and offline replay from the http cache.
+# Exits with status 1 if any check fails
+# Usage: python benchmarks/bench_api_client.py [--speeches 32] [--latency-ms 50] [--flaky-speeches 4]
+#        [--max-workers 8]
+import argparse
+import copy
+import glob
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api_client import OpenParliamentClient  # noqa: E402
+
+FIXTURE_GLOB = os.path.join(os.path.dirname(__file__), "..", "api_data", "*.json")
+
+# Failed responses the stand-in api returns before the first successful one for a flaky speech
+FLAKY_FAILURES = 2
+
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    # GET /api/v1/media/<media id> returns the fixture with the requested id. Ids starting with "flaky" fail with 503
+    # FLAKY_FAILURES times before each success, ids starting with "down" always fail.
+    # Earlier ids answer more slowly, so concurrent responses arrive out of order
+    stand_in_api = None
+
+    def do_GET(self):
+        media_id = self.path.rsplit("/", 1)[-1]
+        self.stand_in_api.record_request(media_id)
+        if not self.path.startswith("/api/v1/media/"):
+            self.__send_json(404, {"error": "Unknown path " + self.path})
+            return
+        time.sleep(self.stand_in_api.get_latency_seconds(media_id))
+        if self.stand_in_api.should_fail(media_id):
+            self.__send_json(503, {"error": "Service unavailable"})
+            return
+        self.__send_body(200, self.stand_in_api.get_media_body(media_id))
+
+    def log_message(self, format, *args):
+        pass
+
+    def __send_json(self, status, body):
+        self.__send_body(status, json.dumps(body).encode("utf-8"))
+
+    def __send_body(self, status, response_body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+
+class StandInApi:
+    def __init__(self, fixture, media_ids, latency_seconds):
+        self.fixture = fixture
+        self.media_ids = media_ids
+        self.latency_seconds = latency_seconds
+        self.__lock = threading.Lock()
+        self.__requests = {}
+        self.__media_bodies = {}
+        handler = type("BoundStandInApiHandler", (StandInApiHandler,), {"stand_in_api": self})
+        self.__server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.api_base_url = "http://127.0.0.1:" + str(self.__server.server_address[1]) + "/api/v1"
+
+    def start(self):
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def record_request(self, media_id):
+        with self.__lock:
+            self.__requests[media_id] = self.__requests.get(media_id, 0) + 1
+
+    def get_requests(self, media_id=None):
+        with self.__lock:
+            if media_id is None:
+                return sum(self.__requests.values())
+            return self.__requests.get(media_id, 0)
+
+    def get_latency_seconds(self, media_id):
+        if media_id not in self.media_ids:
+            return 0
+        return self.latency_seconds * (len(self.media_ids) - self.media_ids.index(media_id)) / len(self.media_ids)
+
+    def should_fail(self, media_id):
+        if media_id.startswith("down"):
+            return True
+        # Every client that asks for a flaky speech gets FLAKY_FAILURES failures before the fixture
+        return media_id.startswith("flaky") and (self.get_requests(media_id) - 1) % (FLAKY_FAILURES + 1) < \
+            FLAKY_FAILURES
+
+    def get_media_body(self, media_id):
+        # The encoded fixture is built once per id, so the stand-in api costs little compared to the client
+        with self.__lock:
+            media_body = self.__media_bodies.get(media_id)
+        if media_body is None:
+            media = copy.deepcopy(self.fixture)
+            media["data"]["id"] = media_id
+            media["data"]["links"]["self"] = self.api_base_url + "/media/" + media_id
+            media_body = json.dumps(media).encode("utf-8")
+            with self.__lock:
+                self.__media_bodies[media_id] = media_body
+        return media_body
+
+
+def get_media_ids(media):
+    return [media_json["data"]["id"] for media_json in media]
+
+
+def run(speech_count, latency_ms, flaky_speech_count, max_workers):
+    with open(sorted(glob.glob(FIXTURE_GLOB))[0], encoding="utf-8") as fixture_file:
+        fixture = json.load(fixture_file)
+    media_ids = ["flaky-" + str(i) if i < flaky_speech_count else "DE-" + str(i).zfill(10)
+                 for i in range(speech_count)]
+
+    stand_in_api = StandInApi(fixture, media_ids, latency_ms / 1000)
+    stand_in_api.start()
+    failures = []
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as sequential_cache_dir, tempfile.TemporaryDirectory() as cache_dir:
+            urls = [stand_in_api.api_base_url + "/media/" + media_id for media_id in media_ids]
+
+            def create_client(client_cache_dir, client_max_workers, offline=False):
+                return OpenParliamentClient(cache_dir=client_cache_dir, offline=offline, fixture_glob=FIXTURE_GLOB,
+                                            api_base_url=stand_in_api.api_base_url, max_workers=client_max_workers,
+                                            requests_per_second=None, max_retries=FLAKY_FAILURES,
+                                            backoff_seconds=0.01)
+
+            # Sequential baseline, the flaky speeches are retried by both clients
+            start = time.perf_counter()
+            sequential_media = create_client(sequential_cache_dir, 1).get_json_many(urls)
+            results["sequential_seconds"] = time.perf_counter() - start
+
+            requests_before = stand_in_api.get_requests()
+            start = time.perf_counter()
+            concurrent_media = create_client(cache_dir, max_workers).get_json_many(urls)
+            results["concurrent_seconds"] = time.perf_counter() - start
+            results["concurrent_requests"] = stand_in_api.get_requests() - requests_before
+            results["speedup"] = results["sequential_seconds"] / results["concurrent_seconds"]
+
+            if get_media_ids(concurrent_media) != media_ids or get_media_ids(sequential_media) != media_ids:
+                failures.append("get_json_many returned the media in a different order than the urls")
+            if concurrent_media != sequential_media:
+                failures.append("Concurrent and sequential responses differ")
+            # The sequential and the concurrent client each retried every flaky speech
+            for media_id in media_ids[:flaky_speech_count]:
+                if stand_in_api.get_requests(media_id) != 2 * FLAKY_FAILURES + 2:
+                    failures.append("Flaky speech " + media_id + " was requested " +
+                                    str(stand_in_api.get_requests(media_id)) + " times")
+            down_response = create_client(None, 1).get_json(stand_in_api.api_base_url + "/media/down-0")
+            if "error" not in down_response or stand_in_api.get_requests("down-0") != FLAKY_FAILURES + 1:
+                failures.append("A failing speech was not retried " + str(FLAKY_FAILURES) +
+                                " times before returning the error")
+
+            # Offline replay from the cache, without any request to the api
+            requests_before = stand_in_api.get_requests()
+            start = time.perf_counter()
+            offline_media = create_client(cache_dir, max_workers, offline=True).get_json_many(urls)
+            results["offline_seconds"] = time.perf_counter() - start
+            if offline_media != concurrent_media:
+                failures.append("Offline responses differ from the cached responses")
+            # Errors are never cached, so an offline run cannot replay them
+            try:
+                create_client(cache_dir, 1, offline=True).get_json(stand_in_api.api_base_url + "/media/down-0")
+                failures.append("An error response was replayed in offline mode")
+            except ValueError:
+                pass
+            # Fixtures are served under their own url without a cache
+            fixture_media = create_client(None, 1, offline=True).get_json(fixture["data"]["links"]["self"])
+            if fixture_media != fixture:
+                failures.append("The api_data fixture was not served in offline mode")
+            if stand_in_api.get_requests() != requests_before:
+                failures.append("Offline mode sent " + str(stand_in_api.get_requests() - requests_before) +
+                                " requests to the api")
+    finally:
+        stand_in_api.stop()
+
+    print(json.dumps(results, indent=2))
+    for failure in failures:
+        print("Failed: " + failure)
+    if len(failures) != 0:
+        sys.exit(1)
+    print("All api client checks passed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--speeches", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--flaky-speeches", type=int, default=4)
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+    run(args.speeches, args.latency_ms, args.flaky_speeches, args.max_workers)
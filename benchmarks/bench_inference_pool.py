@@ -0,0 +1,65 @@
+# Inference throughput benchmark for SentimentModelPool at different worker counts, using a stub model
+# Usage: python benchmarks/bench_inference_pool.py [--workers 1 2 4] [--sentences 4000] [--work-per-character 20]
+import argparse
+import json
+import os
+import sys
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from inference_pool import SentimentModelPool  # noqa: E402
+from sentiment_inference import predict_sentences  # noqa: E402
+from stub_sentiment_model import StubSentimentModel, create_stub_sentiment_model  # noqa: E402
+
+FIXTURE_PATH = os.path.join(os.path.dirname(
+    __file__), "..", "api_data", "api-example-response-2.json")
+
+
+def load_sentences(sentence_count):
+    # Fixture sentences with a numbered suffix, so every sentence is unique and none are deduplicated
+    with open(FIXTURE_PATH, encoding="utf-8") as fixture_file:
+        fixture = json.load(fixture_file)
+    text_body = fixture["data"]["attributes"]["textContents"][0]["textBody"]
+    fixture_sentences = [sentence["text"]
+                         for excerpt in text_body for sentence in excerpt["sentences"]]
+    return [fixture_sentences[i % len(fixture_sentences)] + " " + str(i) for i in range(sentence_count)]
+
+
+def time_predict(sentiment_model, sentences):
+    start = time.perf_counter()
+    sentence_results = predict_sentences(sentiment_model, sentences)
+    return time.perf_counter() - start, sentence_results
+
+
+def run(worker_counts, sentence_count, work_per_character):
+    sentences = load_sentences(sentence_count)
+
+    baseline_seconds, baseline_results = time_predict(
+        StubSentimentModel(work_per_character), sentences)
+    print("workers,seconds,sentences_per_second,speedup")
+    print("in-process," + "%.3f" % baseline_seconds + "," +
+          "%.0f" % (sentence_count / baseline_seconds) + ",1.00")
+
+    for workers in worker_counts:
+        with SentimentModelPool(workers, partial(create_stub_sentiment_model, work_per_character)) as model_pool:
+            # Warm up, so process start and model load are not part of the measurement
+            model_pool.predict_batches([[sentence] for sentence in sentences[:workers]])
+            seconds, sentence_results = time_predict(model_pool, sentences)
+        if not sentence_results.equals(baseline_results):
+            raise ValueError("Pool results differ from the in-process results with " +
+                             str(workers) + " workers")
+        print(str(workers) + "," + "%.3f" % seconds + "," + "%.0f" % (sentence_count / seconds) +
+              "," + "%.2f" % (baseline_seconds / seconds))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, os.cpu_count()}))
+    parser.add_argument("--sentences", type=int, default=4000)
+    parser.add_argument("--work-per-character", type=int, default=20)
+    args = parser.parse_args()
+    run(args.workers, args.sentences, args.work_per_character)
@@ -0,0 +1,176 @@
+# Peak memory of a full SpeechPipeline run at growing corpus sizes, with and without chunk_speeches.
+# Every corpus is crawled once with a single keyword and once with several partly overlapping keywords in date
+# windows. Search pages are generated on request, so the corpus itself is never held in memory.
+# Exits with status 1 if the chunked peak of either crawl grows by more than --max-growth from the smallest to the
+# largest corpus
+# Usage: python benchmarks/bench_memory.py [--speeches 200 400 800] [--sentences-per-speech 100]
+#        [--chunk-speeches 50] [--max-growth 0.5] [--output-formats csv parquet]
+#        [--keywords Klima Migration Rente] [--window-days 90]
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.parse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from pipeline import SpeechPipeline  # noqa: E402
+from run_metrics import reset_metrics  # noqa: E402
+from speech_search import get_timestamp_from_datetime  # noqa: E402
+from stub_sentiment_model import StubSentimentModel  # noqa: E402
+from synthetic_corpus import SyntheticCorpus  # noqa: E402
+
+DEFAULT_SPEECH_COUNTS = [200, 400, 800]
+DEFAULT_CHUNK_SPEECHES = 50
+DEFAULT_MAX_GROWTH = 0.5
+DEFAULT_KEYWORDS = ["Klima", "Migration", "Rente"]
+DEFAULT_WINDOW_DAYS = 90
+# The crawl holds a few search result pages per keyword, small pages are full at every corpus size, so the peak
+# does not grow just because the pages of the smaller corpora are partly empty
+SEARCH_PAGE_SIZE = 10
+
+# Speeches are spread evenly from CORPUS_START, a larger corpus covers more date windows of the same density
+CORPUS_START = datetime(2022, 1, 1)
+SPEECHES_PER_DAY = 2
+
+# Every OVERLAP_EVERY-th speech is also found by the next keyword
+OVERLAP_EVERY = 4
+
+
+class SyntheticSearchClient:
+    # Serves search result pages of a synthetic corpus with the get_json interface of OpenParliamentClient.
+    # Speech n is found by keyword n % len(keywords), and every OVERLAP_EVERY-th speech also by the keyword after
+    # that. The search honours the dateFrom and dateTo parameters, both are inclusive
+    api_base_url = "https://synthetic.invalid/api/v1"
+
+    def __init__(self, speech_count, sentences_per_speech, keywords, seed=0):
+        self.speech_count = speech_count
+        self.sentences_per_speech = sentences_per_speech
+        self.keywords = keywords
+        self.__corpus = SyntheticCorpus(seed)
+
+    def get_speech_date(self, speech_number):
+        return CORPUS_START + timedelta(days=speech_number / SPEECHES_PER_DAY)
+
+    def get_json(self, url):
+        parameters = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        page_number = int(parameters.get("page", ["0"])[0])
+        date_from = int(parameters["dateFrom"][0]) if "dateFrom" in parameters else None
+        date_to = int(parameters["dateTo"][0]) if "dateTo" in parameters else None
+
+        speech_numbers = [speech_number for speech_number in range(self.speech_count)
+                          if self.__is_match(speech_number, parameters["q"][0], date_from, date_to)]
+        first_index = page_number * SEARCH_PAGE_SIZE
+        page_raw_json = {"data": [], "links": {}}
+        for speech_number in speech_numbers[first_index:first_index + SEARCH_PAGE_SIZE]:
+            speech_data = self.__corpus.generate_speech(speech_number, self.sentences_per_speech)["data"]
+            speech_date = self.get_speech_date(speech_number)
+            speech_data["attributes"]["dateStart"] = speech_date.strftime("%Y-%m-%dT%H:%M:%S")
+            speech_data["attributes"]["dateEnd"] = (speech_date + timedelta(
+                seconds=speech_data["attributes"]["duration"])).strftime("%Y-%m-%dT%H:%M:%S")
+            page_raw_json["data"].append(speech_data)
+        if first_index + SEARCH_PAGE_SIZE < len(speech_numbers):
+            page_raw_json["links"]["next"] = url.split("&page=")[0] + "&page=" + str(page_number + 1)
+        return page_raw_json
+
+    def get_json_many(self, urls):
+        return [self.get_json(url) for url in urls]
+
+    def __is_match(self, speech_number, keyword, date_from, date_to):
+        if keyword not in self.keywords:
+            return False
+        keyword_index = self.keywords.index(keyword)
+        if speech_number % len(self.keywords) != keyword_index and not (
+                speech_number % OVERLAP_EVERY == 0 and
+                (speech_number + 1) % len(self.keywords) == keyword_index):
+            return False
+        speech_timestamp = get_timestamp_from_datetime(self.get_speech_date(speech_number))
+        return (date_from is None or speech_timestamp >= date_from) and \
+            (date_to is None or speech_timestamp <= date_to)
+
+
+def run_pipeline(speech_count, sentences_per_speech, chunk_speeches, output_formats, keywords, window_days):
+    # Returns the seconds and the peak bytes allocated by one pipeline run. With window_days the period of the
+    # corpus is crawled in date windows
+    reset_metrics()
+    date_start, date_end = None, None
+    if window_days is not None:
+        date_start, date_end = CORPUS_START, CORPUS_START + timedelta(days=speech_count / SPEECHES_PER_DAY)
+    with tempfile.TemporaryDirectory() as results_dir:
+        speech_pipeline = SpeechPipeline(
+            StubSentimentModel(), results_dir,
+            api_client=SyntheticSearchClient(speech_count, sentences_per_speech, keywords),
+            output_formats=output_formats, dataset_dir=os.path.join(results_dir, "dataset"),
+            chunk_speeches=chunk_speeches)
+        tracemalloc.start()
+        start = time.perf_counter()
+        speech_summaries_df = speech_pipeline.run([(keyword, None) for keyword in keywords],
+                                                  date_start=date_start, date_end=date_end,
+                                                  window_days=window_days)
+        seconds = time.perf_counter() - start
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak_memory_bytes, len(speech_summaries_df)
+
+
+def run(speech_counts, sentences_per_speech, chunk_speeches, max_growth, output_formats, keywords, window_days):
+    crawls = [("single", ["synthetic"], None), ("windowed", keywords, window_days)]
+    results = []
+    for crawl, crawl_keywords, crawl_window_days in crawls:
+        for mode_chunk_speeches in [None, chunk_speeches]:
+            for speech_count in speech_counts:
+                seconds, peak_memory_bytes, summary_rows = run_pipeline(
+                    speech_count, sentences_per_speech, mode_chunk_speeches, output_formats, crawl_keywords,
+                    crawl_window_days)
+                results.append({"crawl": crawl, "keywords": len(crawl_keywords), "window_days": crawl_window_days,
+                                "chunk_speeches": mode_chunk_speeches, "speeches": speech_count,
+                                "sentences_per_speech": sentences_per_speech, "summary_rows": summary_rows,
+                                "seconds": seconds, "peak_memory_bytes": peak_memory_bytes})
+
+    print("crawl,keywords,window_days,chunk_speeches,speeches,sentences_per_speech,summary_rows,seconds,"
+          "peak_memory_mb")
+    for result in results:
+        print(result["crawl"] + "," + str(result["keywords"]) + "," + str(result["window_days"]) + "," +
+              str(result["chunk_speeches"]) + "," + str(result["speeches"]) + "," +
+              str(result["sentences_per_speech"]) + "," + str(result["summary_rows"]) + "," +
+              "%.2f" % result["seconds"] + "," + "%.1f" % (result["peak_memory_bytes"] / 1e6))
+
+    passed = True
+    for crawl, _, _ in crawls:
+        chunked_peaks = [result["peak_memory_bytes"] for result in results
+                         if result["crawl"] == crawl and result["chunk_speeches"] is not None]
+        growth = chunked_peaks[-1] / chunked_peaks[0] - 1
+        print("Chunked peak memory growth of the " + crawl + " crawl from " + str(speech_counts[0]) + " to " +
+              str(speech_counts[-1]) + " speeches: " + "%.1f" % (growth * 100) + "%")
+        passed = passed and growth <= max_growth
+    return results, passed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--speeches", type=int, nargs="+", default=DEFAULT_SPEECH_COUNTS)
+    parser.add_argument("--sentences-per-speech", type=int, default=100)
+    parser.add_argument("--chunk-speeches", type=int, default=DEFAULT_CHUNK_SPEECHES)
+    parser.add_argument("--max-growth", type=float, default=DEFAULT_MAX_GROWTH,
+                        help="allowed relative growth of the chunked peak memory, e.g. 0.5 for 50%%")
+    parser.add_argument("--output-formats", nargs="+", default=["csv"], choices=["csv", "parquet"])
+    parser.add_argument("--keywords", nargs="+", default=DEFAULT_KEYWORDS,
+                        help="keywords of the windowed crawl")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS,
+                        help="date window length of the windowed crawl")
+    parser.add_argument("--output", default=None, help="also write the results as json")
+    args = parser.parse_args()
+
+    results, passed = run(args.speeches, args.sentences_per_speech, args.chunk_speeches, args.max_growth,
+                          args.output_formats, args.keywords, args.window_days)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if not passed:
+        print("Chunked peak memory of a crawl grew by more than " + "%.0f" % (args.max_growth * 100) + "%")
+        sys.exit(1)
@@ -0,0 +1,55 @@
+# Parse throughput benchmark for Speech.__parse_speech
+# Usage: python benchmarks/bench_parse.py [--sentences 1000 5000 20000] [--repeat 3]
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from speech import Speech  # noqa: E402
+
+FIXTURE_PATH = os.path.join(os.path.dirname(
+    __file__), "..", "api_data", "api-example-response-2.json")
+
+
+def load_fixture():
+    with open(FIXTURE_PATH, encoding="utf-8") as fixture_file:
+        return json.load(fixture_file)
+
+
+def scale_speech_raw_json(speech_raw_json, target_sentences):
+    # Repeats the fixture's text body until it holds at least target_sentences sentences
+    scaled = copy.deepcopy(speech_raw_json)
+    text_body = speech_raw_json["data"]["attributes"]["textContents"][0]["textBody"]
+    sentences_per_copy = sum(len(excerpt["sentences"]) for excerpt in text_body)
+    copies = max(1, -(-target_sentences // sentences_per_copy))
+    scaled["data"]["attributes"]["textContents"][0]["textBody"] = text_body * copies
+    return scaled, sentences_per_copy * copies
+
+
+def run(sentence_counts, repeat):
+    speech_raw_json = load_fixture()
+    print("sentences,best_seconds,sentences_per_second")
+    for target_sentences in sentence_counts:
+        scaled, sentence_total = scale_speech_raw_json(
+            speech_raw_json, target_sentences)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            Speech(speech_raw_json=scaled)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(str(sentence_total) + "," + "%.4f" % best + "," +
+              "%.0f" % (sentence_total / best))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, nargs="+",
+                        default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sentences, args.repeat)
@@ -0,0 +1,220 @@
+# Benchmark suite for the analysis pipeline on a synthetic corpus, using a deterministic stub model.
+# Usage: python benchmarks/bench_pipeline.py [--sizes 10x100 100x100 1000x100] [--output benchmark_results.json]
+#                                            [--baseline previous_results.json] [--max-slowdown 0.25]
+# Exits with status 1 if a stage is slower or uses more memory than the baseline by more than the threshold
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sentiment_aggregates import SentimentAggregates  # noqa: E402
+from sentiment_inference import analyse_speeches_sentiment  # noqa: E402
+from speech import Speech  # noqa: E402
+from speech_summary import SUMMARY_INPUT_COLUMNS, generate_summaries, get_main_speaker_sentences  # noqa: E402
+from stub_sentiment_model import StubSentimentModel  # noqa: E402
+from synthetic_corpus import SyntheticCorpus  # noqa: E402
+
+DEFAULT_SIZES = ["10x100", "100x100", "1000x100"]
+DEFAULT_MAX_SLOWDOWN = 0.25
+DEFAULT_MAX_MEMORY_GROWTH = 0.25
+
+# Stages faster than this are not compared against the baseline, their timings are mostly noise
+MIN_COMPARED_SECONDS = 0.05
+
+
+def parse_speeches(corpus):
+    speeches = []
+    for speech_raw_json in corpus:
+        speech = Speech(speech_raw_json=speech_raw_json)
+        speech.set_keyword("Benchmark")
+        speeches.append(speech)
+    return speeches
+
+
+def analyse_sentiment(speeches):
+    sentiment_model = StubSentimentModel()
+    for speech in speeches:
+        speech.analyse_sentiment(sentiment_model)
+
+
+def analyse_speeches_sentiment_batched(speeches):
+    analyse_speeches_sentiment(speeches, StubSentimentModel())
+
+
+def analyse_speeches_sentiment_summary_only(speeches):
+    analyse_speeches_sentiment(speeches, StubSentimentModel(), summary_only=True)
+
+
+def generate_summary(speeches):
+    return [speech.generate_summary() for speech in speeches]
+
+
+def aggregate_summaries(speeches):
+    # The master summary as built by the pipeline write stage
+    summary_sentences = [get_main_speaker_sentences(speech.get_speech_df())[SUMMARY_INPUT_COLUMNS]
+                         for speech in speeches]
+    return generate_summaries(pd.concat(summary_sentences, ignore_index=True))
+
+
+def update_aggregates(speeches):
+    # The faction, keyword and time bucket rollups of CategorisedSpeechGroup
+    sentiment_aggregates = SentimentAggregates()
+    for speech in speeches:
+        sentiment_aggregates.add_speech(speech.get_speech_df())
+    return sentiment_aggregates.get_grouped(["main_speaker_faction"])
+
+
+def write_csv(speeches):
+    with tempfile.TemporaryDirectory() as results_dir:
+        for speech in speeches:
+            speech.write_speech_df_to_csv(
+                results_dir + "/" + speech.get_id() + ".csv")
+
+
+def measure(stage_function, stage_argument, track_memory):
+    # Returns the seconds and, with track_memory, the peak bytes allocated while the stage ran
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = stage_function(stage_argument)
+    seconds = time.perf_counter() - start
+    peak_memory_bytes = None
+    if track_memory:
+        peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return seconds, peak_memory_bytes, result
+
+
+def run_size(speech_count, sentences_per_speech, seed, track_memory):
+    corpus = SyntheticCorpus(seed).generate(speech_count, sentences_per_speech)
+    results = []
+
+    def add_result(stage, sentence_total, seconds, peak_memory_bytes):
+        results.append({
+            "stage": stage,
+            "speeches": speech_count,
+            "sentences_per_speech": sentences_per_speech,
+            "sentences": sentence_total,
+            "seconds": seconds,
+            "sentences_per_second": sentence_total / seconds if seconds != 0 else None,
+            "peak_memory_bytes": peak_memory_bytes
+        })
+
+    # Timings are taken without tracemalloc, which slows allocations down, memory is measured in a second pass
+    seconds, _, speeches = measure(parse_speeches, corpus, False)
+    sentence_total = sum(len(speech.get_speech_df()) for speech in speeches)
+    peak_memory_bytes = measure(parse_speeches, corpus, True)[1] if track_memory else None
+    add_result("parse_speech", sentence_total, seconds, peak_memory_bytes)
+
+    stages = [
+        ("analyse_sentiment", analyse_sentiment),
+        ("analyse_speeches_sentiment", analyse_speeches_sentiment_batched),
+        ("analyse_speeches_sentiment_summary_only", analyse_speeches_sentiment_summary_only),
+        ("generate_summary", generate_summary),
+        ("aggregate_summaries", aggregate_summaries),
+        ("update_aggregates", update_aggregates),
+        ("write_csv", write_csv)
+    ]
+    for stage, stage_function in stages:
+        seconds = measure(stage_function, speeches, False)[0]
+        peak_memory_bytes = measure(stage_function, speeches, True)[1] if track_memory else None
+        add_result(stage, sentence_total, seconds, peak_memory_bytes)
+    return results
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results, baseline, max_slowdown, max_memory_growth):
+    # Returns a list of regression messages, stages that are missing from the baseline are not compared
+    baseline_results = {(result["stage"], result["speeches"], result["sentences_per_speech"]): result
+                        for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(
+            (result["stage"], result["speeches"], result["sentences_per_speech"]))
+        if baseline_result is None:
+            continue
+        size = str(result["speeches"]) + "x" + str(result["sentences_per_speech"])
+        if result["seconds"] >= MIN_COMPARED_SECONDS and \
+                result["seconds"] > baseline_result["seconds"] * (1 + max_slowdown):
+            regressions.append(result["stage"] + " " + size + " took " + "%.3f" % result["seconds"] +
+                               "s, baseline " + "%.3f" % baseline_result["seconds"] + "s")
+        if result["peak_memory_bytes"] is not None and baseline_result["peak_memory_bytes"] is not None and \
+                result["peak_memory_bytes"] > baseline_result["peak_memory_bytes"] * (1 + max_memory_growth):
+            regressions.append(result["stage"] + " " + size + " peak memory " + str(result["peak_memory_bytes"]) +
+                               " bytes, baseline " + str(baseline_result["peak_memory_bytes"]) + " bytes")
+    return regressions
+
+
+def print_results(results):
+    print("stage,speeches,sentences,seconds,sentences_per_second,peak_memory_mb")
+    for result in results:
+        peak_memory_mb = "" if result["peak_memory_bytes"] is None else \
+            "%.1f" % (result["peak_memory_bytes"] / 1024 / 1024)
+        print(result["stage"] + "," + str(result["speeches"]) + "," + str(result["sentences"]) + "," +
+              "%.4f" % result["seconds"] + "," + "%.0f" % result["sentences_per_second"] + "," + peak_memory_mb)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES,
+                        help="corpus sizes as <speeches>x<sentences per speech>")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None,
+                        help="results file of an earlier run to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN)
+    parser.add_argument("--max-memory-growth", type=float, default=DEFAULT_MAX_MEMORY_GROWTH)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the peak memory measurements")
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        speech_count, sentences_per_speech = [int(part) for part in size.split("x")]
+        results += run_size(speech_count, sentences_per_speech, args.seed, not args.no_memory)
+
+    print_results(results)
+
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump({
+            "commit": get_git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "seed": args.seed,
+            "results": results
+        }, output_file, indent=2)
+    print("Results written to " + args.output)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_with_baseline(
+            results, baseline, args.max_slowdown, args.max_memory_growth)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if len(regressions) != 0:
+            sys.exit(1)
+        print("No regressions against " + args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Latency and batch fill benchmark for the scoring service with concurrent clients, using a stub model
+# Usage: python benchmarks/bench_scoring_service.py [--clients 8] [--requests 50] [--sentences-per-request 4]
+#        [--max-batch-size 64] [--max-wait-ms 10] [--work-per-character 20]
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_inference_pool import load_sentences  # noqa: E402
+from scoring_service import ScoringService, ScoringServiceClient  # noqa: E402
+from stub_sentiment_model import StubSentimentModel  # noqa: E402
+
+
+def run_client(url, request_sentences):
+    scoring_client = ScoringServiceClient(url)
+    return [scoring_client.predict_sentiment(sentences, True) for sentences in request_sentences]
+
+
+def run(client_count, request_count, sentences_per_request, max_batch_size, max_wait_ms, work_per_character):
+    sentiment_model = StubSentimentModel(work_per_character)
+    sentences = load_sentences(
+        client_count * request_count * sentences_per_request)
+    client_requests = [[sentences[start:start + sentences_per_request]
+                        for start in range(client * request_count * sentences_per_request,
+                                           (client + 1) * request_count * sentences_per_request,
+                                           sentences_per_request)]
+                       for client in range(client_count)]
+
+    scoring_service = ScoringService(
+        sentiment_model, port=0, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    scoring_service.start()
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=client_count) as executor:
+            client_results = list(executor.map(
+                lambda request_sentences: run_client(scoring_service.get_url(), request_sentences),
+                client_requests))
+        seconds = time.perf_counter() - start
+        service_stats = scoring_service.micro_batcher.get_stats()
+    finally:
+        scoring_service.stop()
+
+    # Micro batching must not change the result of any sentence
+    for request_sentences, request_results in zip(client_requests, client_results):
+        for batch, result in zip(request_sentences, request_results):
+            if list(result) != [list(expected) for expected in sentiment_model.predict_sentiment(batch, True)]:
+                raise ValueError("Scoring service results differ from the in-process results")
+
+    service_stats["seconds"] = seconds
+    service_stats["sentences_per_second"] = len(sentences) / seconds
+    print(json.dumps(service_stats, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--sentences-per-request", type=int, default=4)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--work-per-character", type=int, default=20)
+    args = parser.parse_args()
+    run(args.clients, args.requests, args.sentences_per_request, args.max_batch_size, args.max_wait_ms,
+        args.work_per_character)
@@ -0,0 +1,54 @@
+# Startup time benchmark for the main.py subcommands, each command runs in a fresh interpreter.
+# Usage: python benchmarks/bench_startup.py [--repeat 5]
+# score is measured with --help, a real score run is dominated by loading the sentiment model
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+EXAMPLE_RESULTS_DIR = os.path.join("results", "auslander-keyword")
+FIXTURE_MEDIA_URL = "https://de.openparliament.tv/api/v1/media/DE-0200028012"
+
+
+def get_commands(output_dir):
+    return [
+        ("python", ["-c", "pass"]),
+        ("--help", ["main.py", "--help"]),
+        ("score --help", ["main.py", "score", "--help"]),
+        ("fetch", ["main.py", "fetch", "--offline", "--urls", FIXTURE_MEDIA_URL,
+                   "--output-dir", os.path.join(output_dir, "raw")]),
+        ("summarize", ["main.py", "summarize", EXAMPLE_RESULTS_DIR,
+                       "--output", os.path.join(output_dir, "master_summary.csv")]),
+        ("plot", ["main.py", "plot", EXAMPLE_RESULTS_DIR,
+                  "--output", os.path.join(output_dir, "scatter_plot.png")])
+    ]
+
+
+def time_command(command_args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command_args, cwd=REPOSITORY_DIR, check=True,
+                       stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run(repeat):
+    with tempfile.TemporaryDirectory() as output_dir:
+        print("command,median_seconds,min_seconds")
+        for name, command_args in get_commands(output_dir):
+            timings = time_command(command_args, repeat)
+            print(name + "," + "%.3f" % statistics.median(timings) +
+                  "," + "%.3f" % min(timings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -0,0 +1,35 @@
+# Deterministic stand-in for germansentiment.SentimentModel, so benchmarks run without torch or model downloads
+import hashlib
+
+SENTIMENT_LABELS = ["positive", "negative", "neutral"]
+
+
+class StubSentimentModel:
+    work_per_character = None
+
+    def __init__(self, work_per_character=0):
+        # work_per_character adds CPU bound hashing per character, to mimic a model whose cost grows with length
+        self.work_per_character = work_per_character
+
+    def predict_sentiment(self, texts, output_probabilities=False):
+        sentiment_scores = []
+        sentiment_weights = []
+        for text in texts:
+            digest = hashlib.sha256(text.encode("utf-8")).digest()
+            for _ in range(self.work_per_character * len(text)):
+                digest = hashlib.sha256(digest).digest()
+
+            raw_weights = [digest[0] + 1, digest[1] + 1, digest[2] + 1]
+            weights = [raw_weight / sum(raw_weights) for raw_weight in raw_weights]
+            sentiment_scores.append(
+                SENTIMENT_LABELS[weights.index(max(weights))])
+            sentiment_weights.append([[label, weight] for label, weight in zip(
+                SENTIMENT_LABELS, weights)])
+
+        if output_probabilities:
+            return sentiment_scores, sentiment_weights
+        return sentiment_scores
+
+
+def create_stub_sentiment_model(work_per_character=0):
+    return StubSentimentModel(work_per_character)
@@ -0,0 +1,133 @@
+# Synthetic corpus generator seeded from api_data/api-example-response-2.json.
+# Speeches look like media api responses, so they can be parsed by Speech(speech_raw_json=...)
+import copy
+import json
+import os
+import random
+
+FIXTURE_PATH = os.path.join(os.path.dirname(
+    __file__), "..", "api_data", "api-example-response-2.json")
+
+# Chance that an excerpt after a main speaker excerpt is a comment or a president interjection,
+# roughly the mix of the fixture speech
+COMMENT_PROBABILITY = 0.55
+PRESIDENT_INTERJECTION_PROBABILITY = 0.1
+
+# Share of speeches where nobody has the main-speaker status, these are skipped by the summary
+NO_MAIN_SPEAKER_PROBABILITY = 0.05
+
+
+def load_fixture():
+    with open(FIXTURE_PATH, encoding="utf-8") as fixture_file:
+        return json.load(fixture_file)
+
+
+def get_sentence_pools(fixture):
+    # Sentence texts of the fixture grouped by excerpt type and speaker status
+    sentence_pools = {}
+    for excerpt in fixture["data"]["attributes"]["textContents"][0]["textBody"]:
+        pool_key = (excerpt["type"], excerpt["speakerstatus"])
+        sentence_pools.setdefault(pool_key, []).extend(
+            sentence["text"] for sentence in excerpt["sentences"])
+    return sentence_pools
+
+
+class SyntheticCorpus:
+    seed = None
+    unique_sentence_ratio = None
+
+    def __init__(self, seed=0, unique_sentence_ratio=0.8):
+        # unique_sentence_ratio is the share of sentences that get a unique suffix, the rest repeat fixture
+        # sentences exactly, like the boilerplate that appears in most real speeches
+        self.seed = seed
+        self.unique_sentence_ratio = unique_sentence_ratio
+        self.__fixture = load_fixture()
+        self.__sentence_pools = get_sentence_pools(self.__fixture)
+
+        people = self.__fixture["data"]["relationships"]["people"]["data"]
+        self.__president = next(excerpt["speaker"] for excerpt in
+                                self.__fixture["data"]["attributes"]["textContents"][0]["textBody"]
+                                if excerpt["speakerstatus"] == "president")
+        self.__main_speakers = [person["attributes"]["label"] for person in people
+                                if person["attributes"]["label"] != self.__president]
+
+    def generate(self, speech_count, sentences_per_speech, first_speech_number=0):
+        # Returns a list of speech_count raw speeches with about sentences_per_speech sentences each.
+        # first_speech_number numbers the speeches, so a corpus can be generated page by page with unique ids
+        random_generator = random.Random(self.seed)
+        return [self.__generate_speech(random_generator, speech_number, sentences_per_speech)
+                for speech_number in range(first_speech_number, first_speech_number + speech_count)]
+
+    def generate_speech(self, speech_number, sentences_per_speech):
+        # Returns one raw speech seeded by its number, so it is the same whichever search result page asks for it
+        random_generator = random.Random(str(self.seed) + "-" + str(speech_number))
+        return self.__generate_speech(random_generator, speech_number, sentences_per_speech)
+
+    def __generate_speech(self, random_generator, speech_number, sentences_per_speech):
+        speech_raw_json = {"meta": self.__fixture["meta"],
+                           "data": copy.copy(self.__fixture["data"])}
+        speech_data = speech_raw_json["data"]
+        speech_id = "ID9" + str(speech_number).zfill(8)
+        speech_data["id"] = "DE-9" + str(speech_number).zfill(9)
+        speech_data["links"] = {
+            "self": "https://de.openparliament.tv/api/v1/media/" + speech_data["id"]}
+
+        main_speaker = random_generator.choice(self.__main_speakers)
+        has_main_speaker = random_generator.random() >= NO_MAIN_SPEAKER_PROBABILITY
+
+        text_body = []
+        time_start = 1.0
+        sentence_count = 0
+        excerpt_kind = "president"
+        while sentence_count < sentences_per_speech:
+            if excerpt_kind == "comment":
+                excerpt_sentences = 1
+            else:
+                excerpt_sentences = random_generator.randint(1, 4)
+            excerpt_sentences = min(
+                excerpt_sentences, sentences_per_speech - sentence_count)
+
+            if excerpt_kind == "comment":
+                excerpt, time_start = self.__generate_excerpt(
+                    random_generator, speech_id, "comment", None, None, excerpt_sentences, time_start)
+            elif excerpt_kind == "president":
+                excerpt, time_start = self.__generate_excerpt(
+                    random_generator, speech_id, "speech", self.__president, "president", excerpt_sentences,
+                    time_start)
+            else:
+                speaker_status = "main-speaker" if has_main_speaker else None
+                excerpt, time_start = self.__generate_excerpt(
+                    random_generator, speech_id, "speech", main_speaker, speaker_status, excerpt_sentences,
+                    time_start)
+            text_body.append(excerpt)
+            sentence_count += excerpt_sentences
+
+            if excerpt_kind != "main-speaker":
+                excerpt_kind = "main-speaker"
+            elif random_generator.random() < COMMENT_PROBABILITY:
+                excerpt_kind = "comment"
+            elif random_generator.random() < PRESIDENT_INTERJECTION_PROBABILITY:
+                excerpt_kind = "president"
+
+        speech_data["attributes"] = dict(speech_data["attributes"])
+        speech_data["attributes"]["duration"] = int(time_start)
+        speech_data["attributes"]["textContents"] = [
+            dict(speech_data["attributes"]["textContents"][0], textBody=text_body)]
+        return speech_raw_json
+
+    def __generate_excerpt(self, random_generator, speech_id, excerpt_type, speaker, speaker_status,
+                           sentence_count, time_start):
+        pool = self.__sentence_pools[(excerpt_type, "main-speaker" if speaker_status is None and
+                                      excerpt_type == "speech" else speaker_status)]
+        sentences = []
+        for _ in range(sentence_count):
+            text = random_generator.choice(pool)
+            if random_generator.random() < self.unique_sentence_ratio:
+                text += " (" + str(random_generator.getrandbits(32)) + ")"
+            time_end = time_start + round(random_generator.uniform(1, 15), 2)
+            sentences.append({"text": text, "timeStart": "%.3f" % time_start,
+                              "timeEnd": "%.3f" % time_end})
+            time_start = time_end
+        excerpt = {"speech_id": speech_id, "type": excerpt_type, "speaker": speaker,
+                   "speakerstatus": speaker_status, "sentences": sentences}
+        return excerpt, time_start
@@ -1,7 +1,9 @@
-from speech import Speech
-import pandas as pd
+import os
 from datetime import datetime
 
+from sentiment_aggregates import DEFAULT_TIME_BUCKET, SentimentAggregates
+from sentiment_inference import analyse_speeches_sentiment
+
 
 class CategorisedSpeechGroup:
     categorised_speeches = None
@@ -9,108 +11,49 @@ class CategorisedSpeechGroup:
     faction = None
     analysis_results = None
 
-    def __init__(self, categorised_speeches, keyword, faction="Unknown"):
+    def __init__(self, categorised_speeches, keyword, faction="Unknown", time_bucket=DEFAULT_TIME_BUCKET):
         self.categorised_speeches = categorised_speeches
         self.keyword = keyword
         self.faction = faction
-
-    def analyse_speeches(self, sentiment_model):
-        all_speech_df = pd.DataFrame()
+        # Totals per faction, party, keyword, speaker and time bucket, see sentiment_aggregates.py
+        self.analysis_results = SentimentAggregates(time_bucket)
+
+    def analyse_speeches(self, sentiment_model, sentiment_cache=None, summary_only=False):
+        # The group only reports on the main speaker, so with summary_only only the sentences the summary uses are
+        # scored and the other sentences of the speeches are left without a score
+        analyse_speeches_sentiment(self.categorised_speeches, sentiment_model,
+                                   sentiment_cache=sentiment_cache, summary_only=summary_only)
         for speech in self.categorised_speeches:
-            # analyse_sentiment sets the speech's sentiment_score and other columns (initiated as None)
-            speech.analyse_sentiment(sentiment_model)
-
-            # Now that the sentiment scores have been added to the dataframe, we can get the df
-            speech_df = speech.get_speech_df()
-
-            # We now create one big dataframe with all the speeches so we can analysise them together
-            all_speech_df = pd.concat([all_speech_df, speech_df],
-                                      ignore_index=True)
+            self.add_speech(speech)
+        return self.analysis_results
 
-        # Now we need to filter the dataframe to only get the mainspeaker's sentence results, and group the scores
-        main_speaker_sentences = all_speech_df[all_speech_df['sentence_speaker_status']
-                                               == "main-speaker"]
+    def add_speech(self, speech):
+        # Adds an already scored speech to the totals without rescanning the speeches added before
+        if speech.get_speech_df()["speech_keyword"].isna().all():
+            speech.set_keyword(self.keyword)
+        if not self.analysis_results.add_speech(speech.get_speech_df()):
+            print("No main speaker found for speech id " + speech.get_id())
 
-        # now we need to group by the main speaker's faction, party, agenda item title, and main speaker
-        main_speaker_sentences_grouped = main_speaker_sentences.groupby(
-            ["sentence_speaker_faction", "sentence_speaker_party", "speech_agenda_item_title", "sentence_speaker"]).sum()
-
-        return main_speaker_sentences_grouped
+    def merge(self, other):
+        # Combines the totals of a group analysed in another run or worker
+        self.analysis_results.merge(other.analysis_results)
+        return self
 
     def get_results_grouped_by_faction(self):
-        if self.analysis_results is None:
+        if self.analysis_results.is_empty():
             raise ValueError("Must analyse speeches before getting results")
 
-        results_df_grouped = self.analysis_results[["main_speaker_faction", "total_duration", "duration_positive",
-                                                    "duration_neutral", "duration_negative"]].groupby(["main_speaker_faction"]).sum()
-
-        results_df_grouped["percentage_positive"] = results_df_grouped["duration_positive"] / \
-            results_df_grouped["total_duration"]
-        results_df_grouped["percentage_neutral"] = results_df_grouped["duration_neutral"] / \
-            results_df_grouped["total_duration"]
-        results_df_grouped["percentage_negative"] = results_df_grouped["duration_negative"] / \
-            results_df_grouped["total_duration"]
-
-        return results_df_grouped
+        return self.analysis_results.get_grouped(["main_speaker_faction"])
 
-    def generate_report(self):
-        if self.analysis_results is None:
+    def generate_report(self, results_dir="results"):
+        if self.analysis_results.is_empty():
             raise ValueError("Must analyse speeches before generating report")
 
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 
-        grouped_by_party = self.get_results_grouped_by_faction()
-        grouped_by_party["keyword"] = self.keyword
-        grouped_by_party.to_csv(
-            "results/" + self.keyword + "_grouped_by_faction"+timestamp+".csv")
-
-    def __analyse_speech(self, speech: Speech, sentiment_model):
-        speech.analyse_sentiment(sentiment_model)
-
-        sentences = speech.get_sentences_by_speaker_status("main-speaker")
-
-        total_duration = 0
-        duration_positive = 0
-        duration_neutral = 0
-        duration_negative = 0
-
-        for sentence in sentences:
-            total_duration += sentence["duration"]
-            if sentence["sentiment_score"] == "positive":
-                duration_positive += sentence["duration"]
-            elif sentence["sentiment_score"] == "neutral":
-                duration_neutral += sentence["duration"]
-            elif sentence["sentiment_score"] == "negative":
-                duration_negative += sentence["duration"]
-            else:
-                raise ValueError("Invalid sentiment score")
-
-        metadata = speech.get_speech_metadata()
-
-        try:
-            analysis_results = {
-                "total_duration": total_duration,
-                "duration_positive": duration_positive,
-                "duration_neutral": duration_neutral,
-                "duration_negative": duration_negative,
-                "agenda_item_title": metadata["agenda_item_title"],
-                "main_speaker": metadata["main_speaker"],
-                "main_speaker_party": metadata["main_speaker_party"],
-                "main_speaker_faction": metadata["main_speaker_faction"]
-            }
-        except:
-            print(metadata)
-            raise ValueError("Invalid metadata")
-
-        if total_duration != 0:
-            analysis_results["percentage_positive"] = duration_positive / \
-                total_duration
-            analysis_results["percentage_neutral"] = duration_neutral / \
-                total_duration
-            analysis_results["percentage_negative"] = duration_negative / \
-                total_duration
-        else:
-            analysis_results["percentage_positive"] = 0
-            analysis_results["percentage_neutral"] = 0
-            analysis_results["percentage_negative"] = 0
-        return analysis_results
+        grouped_by_faction = self.get_results_grouped_by_faction()
+        grouped_by_faction["keyword"] = self.keyword
+        report_path = os.path.join(
+            results_dir, self.keyword + "_grouped_by_faction" + timestamp + ".csv")
+        grouped_by_faction.to_csv(report_path)
+        return report_path
@@ -0,0 +1,330 @@
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+import pandas as pd
+
+from run_manifest import CONTENT_COLUMNS
+from speech import KEYWORD_SEPARATOR
+from speech_summary import SENTIMENT_SCORES
+
+DEFAULT_INDEX_PATH = "./results/corpus_index.sqlite"
+
+# Speech level columns, stored once per speech
+INDEX_SPEECH_COLUMNS = ["speech_id", "speech_url", "speech_keyword", "speech_keywords", "speech_duration",
+                        "speech_date_start", "speech_date_end", "speech_agenda_item_title"]
+
+# Sentence level columns, sentence_text is also indexed for full text search
+INDEX_SENTENCE_COLUMNS = ["speech_id", "sentence_index", "sentence_speaker", "sentence_speaker_status",
+                          "sentence_speaker_party", "sentence_speaker_faction", "sentence_type", "sentence_text",
+                          "sentence_time_start", "sentence_time_end", "sentence_duration",
+                          "sentence_sentiment_score", "sentence_sentiment_positive_weight",
+                          "sentence_sentiment_negative_weight", "sentence_sentiment_neutral_weight"]
+
+# Columns queries and rollups can group by, mapped to the table that holds them. speech_keyword groups by every
+# keyword that found a speech, so a speech found by several keywords is counted under each of them
+GROUP_COLUMNS = {
+    "sentence_speaker": "sentences", "sentence_speaker_party": "sentences",
+    "sentence_speaker_faction": "sentences", "speech_keyword": "speech_keywords", "speech_id": "speeches",
+    "speech_date": "speeches", "speech_month": "speeches"
+}
+
+# Number of sentences inserted per executemany call
+INSERT_CHUNK_SIZE = 5000
+
+# A search query is split into double quoted phrases, parentheses and terms. Terms that are fts5 barewords and the
+# AND, OR, NOT and NEAR operators keep their fts5 meaning, other terms like CDU/CSU are quoted as phrases
+QUERY_TOKEN_PATTERN = re.compile(r'"(?:[^"]|"")*"|[()]|[^\s()"]+')
+BAREWORD_PATTERN = re.compile(r"\w+")
+QUERY_OPERATORS = {"AND", "OR", "NOT", "NEAR"}
+
+
+def get_index_hash(speech_df):
+    # Changes when the content, the keywords or the sentiment scores of a speech change, so a speech that was
+    # rescored or found by another keyword is indexed again
+    index_content = speech_df[CONTENT_COLUMNS + ["speech_keywords", "sentence_sentiment_score"]].to_json(
+        orient="values", force_ascii=False)
+    return hashlib.sha256(index_content.encode("utf-8")).hexdigest()
+
+
+def get_date_string(date_value):
+    # Accepts a date, datetime or iso string, dates are compared as YYYY-MM-DD strings
+    if date_value is None:
+        return None
+    if hasattr(date_value, "isoformat"):
+        date_value = date_value.isoformat()
+    return str(date_value)[:10]
+
+
+def get_match_query(query):
+    # Makes a search query safe for fts5 MATCH, e.g. CDU/CSU UN-Migrations* becomes "CDU/CSU" "UN-Migrations"*
+    match_tokens = []
+    for token in QUERY_TOKEN_PATTERN.findall(query):
+        term = token.rstrip("*")
+        if token.startswith('"') or token in ("(", ")") or token in QUERY_OPERATORS or \
+                BAREWORD_PATTERN.fullmatch(term):
+            match_tokens.append(token)
+        elif term != "":
+            match_tokens.append('"' + term.replace('"', '""') + '"' + token[len(term):])
+    return " ".join(match_tokens)
+
+
+def get_column_values(speech_df, column):
+    # sqlite only accepts python types, missing values are stored as NULL
+    return [None if pd.isna(value) else value for value in speech_df[column].tolist()]
+
+
+class CorpusIndex:
+    index_path = None
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        self.index_path = index_path
+
+        index_directory = os.path.dirname(index_path)
+        if index_directory != "":
+            os.makedirs(index_directory, exist_ok=True)
+
+        # Speeches are added from the pipeline's write thread, so the connection is shared between threads
+        # and every use of it holds the lock
+        self.__lock = threading.RLock()
+        self.__connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.__connection.executescript(
+            "CREATE TABLE IF NOT EXISTS speeches ("
+            "speech_id TEXT PRIMARY KEY, speech_url TEXT, speech_keyword TEXT, speech_keywords TEXT, "
+            "speech_duration REAL, speech_date_start TEXT, speech_date_end TEXT, speech_agenda_item_title TEXT, "
+            "speech_date TEXT, index_hash TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS sentences ("
+            "sentence_id INTEGER PRIMARY KEY, speech_id TEXT NOT NULL, sentence_index INTEGER, "
+            "sentence_speaker TEXT, sentence_speaker_status TEXT, sentence_speaker_party TEXT, "
+            "sentence_speaker_faction TEXT, sentence_type TEXT, sentence_text TEXT, sentence_time_start REAL, "
+            "sentence_time_end REAL, sentence_duration REAL, sentence_sentiment_score TEXT, "
+            "sentence_sentiment_positive_weight REAL, sentence_sentiment_negative_weight REAL, "
+            "sentence_sentiment_neutral_weight REAL);"
+            # One row per keyword in speeches.speech_keywords, for grouping by keyword
+            "CREATE TABLE IF NOT EXISTS speech_keywords ("
+            "speech_id TEXT NOT NULL, speech_keyword TEXT NOT NULL, PRIMARY KEY (speech_id, speech_keyword));"
+            "CREATE INDEX IF NOT EXISTS sentences_speech_id ON sentences (speech_id);"
+            "CREATE INDEX IF NOT EXISTS speeches_speech_date ON speeches (speech_date);"
+            # The full text index reads the text from the sentences table instead of storing a second copy
+            "CREATE VIRTUAL TABLE IF NOT EXISTS sentence_text_index USING fts5("
+            "sentence_text, content='sentences', content_rowid='sentence_id');")
+        # Indexes created before the speech_keywords table get it filled from their speeches
+        if self.__connection.execute("SELECT COUNT(*) FROM speech_keywords").fetchone()[0] == 0:
+            for speech_id, speech_keywords in self.__connection.execute(
+                    "SELECT speech_id, speech_keywords FROM speeches").fetchall():
+                self.__insert_speech_keywords(speech_id, speech_keywords)
+        self.__connection.commit()
+
+    def add_speech(self, speech_df):
+        # Returns True if the speech was added or replaced, False if it is already indexed unchanged
+        return self.add_speeches([speech_df]) == 1
+
+    def add_speeches(self, speech_dfs):
+        # Adds scored speech frames in one transaction, unchanged speeches are skipped.
+        # Returns the number of speeches that were added or replaced
+        with self.__lock:
+            indexed_speeches = 0
+            for speech_df in speech_dfs:
+                if len(speech_df) == 0:
+                    continue
+                if "speech_keywords" not in speech_df:
+                    speech_df = speech_df.assign(speech_keywords=speech_df["speech_keyword"])
+                speech_id = speech_df["speech_id"].iloc[0]
+
+                row = self.__connection.execute(
+                    "SELECT index_hash, speech_keyword, speech_keywords FROM speeches WHERE speech_id = ?",
+                    (speech_id,)).fetchone()
+                if row is not None:
+                    # A speech found by several keywords, e.g. in the results directories of different
+                    # keywords, keeps every keyword and its first primary keyword
+                    keywords = row[2].split(KEYWORD_SEPARATOR) if row[2] is not None else []
+                    for keyword in str(speech_df["speech_keywords"].iloc[0]).split(KEYWORD_SEPARATOR):
+                        if keyword not in keywords:
+                            keywords.append(keyword)
+                    speech_df = speech_df.assign(speech_keyword=row[1],
+                                                 speech_keywords=KEYWORD_SEPARATOR.join(keywords))
+
+                index_hash = get_index_hash(speech_df)
+                if row is not None and row[0] == index_hash:
+                    continue
+                if row is not None:
+                    self.__remove_speech(speech_id)
+                self.__insert_speech(speech_df, index_hash)
+                indexed_speeches += 1
+            self.__connection.commit()
+            return indexed_speeches
+
+    def add_results_dir(self, results_dir):
+        # Adds the speech csvs of a results directory, e.g. results/europaische-union-keyword
+        speech_csv_paths = sorted(glob.glob(os.path.join(results_dir, "ID*.csv")))
+        return self.add_speeches(pd.read_csv(speech_csv_path) for speech_csv_path in speech_csv_paths)
+
+    def set_speech_keywords(self, speech_id, speech_keywords):
+        # Adds keywords that were found after the speech was indexed, its primary keyword stays the same.
+        # Returns False if the speech is not indexed
+        with self.__lock:
+            row = self.__connection.execute(
+                "SELECT speech_keywords FROM speeches WHERE speech_id = ?", (speech_id,)).fetchone()
+            if row is None:
+                return False
+            keywords = row[0].split(KEYWORD_SEPARATOR) if row[0] is not None else []
+            for keyword in speech_keywords:
+                if keyword not in keywords:
+                    keywords.append(keyword)
+            self.__connection.execute("UPDATE speeches SET speech_keywords = ? WHERE speech_id = ?",
+                                      (KEYWORD_SEPARATOR.join(keywords), speech_id))
+            self.__insert_speech_keywords(speech_id, KEYWORD_SEPARATOR.join(keywords))
+            self.__connection.commit()
+            return True
+
+    def search_sentences(self, query=None, factions=None, date_start=None, date_end=None, main_speaker_only=True,
+                         limit=None):
+        # Returns the matching sentences with their speech metadata, best full text matches first.
+        # query uses the fts5 syntax, e.g. Migration, "Europäische Union" or Klima*, see get_match_query.
+        # Raises ValueError if the query is still not valid, e.g. Klima AND
+        where_sql, parameters = self.__get_filter(query, factions, date_start, date_end, main_speaker_only)
+        order_sql = " ORDER BY sentence_text_index.rank" if query is not None else \
+            " ORDER BY speeches.speech_date, sentences.speech_id, sentences.sentence_index"
+        limit_sql = " LIMIT " + str(int(limit)) if limit is not None else ""
+        select_columns = ["speeches." + column for column in INDEX_SPEECH_COLUMNS] + \
+            ["sentences." + column for column in INDEX_SENTENCE_COLUMNS if column != "speech_id"]
+        return self.__read_sql_query(
+            "SELECT " + ", ".join(select_columns) + self.__get_from_sql(query) + where_sql + order_sql + limit_sql,
+            parameters, query)
+
+    def get_sentiment_rollup(self, query=None, group_by=("sentence_speaker_faction",), factions=None,
+                             date_start=None, date_end=None, main_speaker_only=True):
+        # Sums the duration and counts the sentences per sentiment of the matching sentences, grouped by any of
+        # GROUP_COLUMNS. speech_date and speech_month group by day and by YYYY-MM, speech_keyword by every keyword
+        # that found the speech
+        group_by = list(group_by)
+        for group_column in group_by:
+            if group_column not in GROUP_COLUMNS:
+                raise ValueError("Cannot group by " + group_column)
+
+        group_sql = [self.__get_group_sql(group_column) for group_column in group_by]
+        select_sql = [column_sql + " AS " + group_column for column_sql, group_column in zip(group_sql, group_by)]
+        select_sql.append("COUNT(DISTINCT sentences.speech_id) AS speeches")
+        for sentiment_score in SENTIMENT_SCORES:
+            select_sql.append("TOTAL(CASE WHEN sentences.sentence_sentiment_score = '" + sentiment_score +
+                              "' THEN sentences.sentence_duration END) AS duration_" + sentiment_score)
+            select_sql.append("COUNT(CASE WHEN sentences.sentence_sentiment_score = '" + sentiment_score +
+                              "' THEN 1 END) AS sentences_" + sentiment_score)
+
+        where_sql, parameters = self.__get_filter(query, factions, date_start, date_end, main_speaker_only)
+        group_by_sql = " GROUP BY " + ", ".join(group_sql) if len(group_sql) != 0 else ""
+        rollup_df = self.__read_sql_query(
+            "SELECT " + ", ".join(select_sql) + self.__get_from_sql(query, "speech_keyword" in group_by) +
+            where_sql + group_by_sql,
+            parameters, query)
+
+        rollup_df["total_duration"] = sum(rollup_df["duration_" + sentiment_score]
+                                          for sentiment_score in SENTIMENT_SCORES)
+        for sentiment_score in SENTIMENT_SCORES:
+            rollup_df["percentage_" + sentiment_score] = \
+                rollup_df["duration_" + sentiment_score] / rollup_df["total_duration"]
+        if len(group_by) != 0:
+            rollup_df = rollup_df.set_index(group_by)
+        return rollup_df
+
+    def get_stats(self):
+        with self.__lock:
+            speeches = self.__connection.execute("SELECT COUNT(*) FROM speeches").fetchone()[0]
+            sentences = self.__connection.execute("SELECT COUNT(*) FROM sentences").fetchone()[0]
+        return {"speeches": speeches, "sentences": sentences}
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print("Corpus index " + self.index_path + ": " + str(stats["speeches"]) + " speeches, " +
+              str(stats["sentences"]) + " sentences")
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def __read_sql_query(self, sql, parameters, query):
+        # pandas wraps sqlite errors, an invalid search query is the only error a caller can cause
+        with self.__lock:
+            try:
+                return pd.read_sql_query(sql, self.__connection, params=parameters)
+            except pd.errors.DatabaseError as error:
+                if query is not None and isinstance(error.__cause__, sqlite3.OperationalError):
+                    raise ValueError("Invalid search query " + query + ": " + str(error.__cause__)) from error
+                raise
+
+    @staticmethod
+    def __get_from_sql(query, by_keyword=False):
+        from_sql = " FROM sentences JOIN speeches ON speeches.speech_id = sentences.speech_id"
+        if by_keyword:
+            from_sql += " JOIN speech_keywords ON speech_keywords.speech_id = sentences.speech_id"
+        if query is not None:
+            from_sql += " JOIN sentence_text_index ON sentence_text_index.rowid = sentences.sentence_id"
+        return from_sql
+
+    @staticmethod
+    def __get_filter(query, factions, date_start, date_end, main_speaker_only):
+        conditions = []
+        parameters = []
+        if query is not None:
+            conditions.append("sentence_text_index MATCH ?")
+            parameters.append(get_match_query(query))
+        if factions is not None:
+            conditions.append("sentences.sentence_speaker_faction IN (" + ",".join("?" * len(factions)) + ")")
+            parameters += list(factions)
+        if date_start is not None:
+            conditions.append("speeches.speech_date >= ?")
+            parameters.append(get_date_string(date_start))
+        if date_end is not None:
+            conditions.append("speeches.speech_date <= ?")
+            parameters.append(get_date_string(date_end))
+        if main_speaker_only:
+            # The same sentences the summary uses, see speech_summary.get_summary_sentence_mask
+            conditions.append("sentences.sentence_speaker_status = 'main-speaker' AND "
+                              "sentences.sentence_type = 'speech'")
+        where_sql = " WHERE " + " AND ".join(conditions) if len(conditions) != 0 else ""
+        return where_sql, parameters
+
+    @staticmethod
+    def __get_group_sql(group_column):
+        if group_column == "speech_month":
+            return "substr(speeches.speech_date, 1, 7)"
+        return GROUP_COLUMNS[group_column] + "." + group_column
+
+    def __insert_speech(self, speech_df, index_hash):
+        speech_values = [get_column_values(speech_df.iloc[:1], column)[0] for column in INDEX_SPEECH_COLUMNS]
+        speech_date = get_date_string(speech_df["speech_date_start"].iloc[0])
+        self.__connection.execute(
+            "INSERT INTO speeches (" + ", ".join(INDEX_SPEECH_COLUMNS) + ", speech_date, index_hash) VALUES (" +
+            ",".join("?" * (len(INDEX_SPEECH_COLUMNS) + 2)) + ")", speech_values + [speech_date, index_hash])
+
+        speech_df = speech_df.assign(sentence_index=range(len(speech_df)))
+        sentence_rows = list(zip(*[get_column_values(speech_df, column) for column in INDEX_SENTENCE_COLUMNS]))
+        for chunk_start in range(0, len(sentence_rows), INSERT_CHUNK_SIZE):
+            self.__connection.executemany(
+                "INSERT INTO sentences (" + ", ".join(INDEX_SENTENCE_COLUMNS) + ") VALUES (" +
+                ",".join("?" * len(INDEX_SENTENCE_COLUMNS)) + ")",
+                sentence_rows[chunk_start:chunk_start + INSERT_CHUNK_SIZE])
+        self.__connection.execute(
+            "INSERT INTO sentence_text_index (rowid, sentence_text) "
+            "SELECT sentence_id, sentence_text FROM sentences WHERE speech_id = ?",
+            (speech_df["speech_id"].iloc[0],))
+        self.__insert_speech_keywords(speech_values[0], speech_values[INDEX_SPEECH_COLUMNS.index("speech_keywords")])
+
+    def __insert_speech_keywords(self, speech_id, speech_keywords):
+        if speech_keywords is None:
+            return
+        self.__connection.executemany(
+            "INSERT OR IGNORE INTO speech_keywords (speech_id, speech_keyword) VALUES (?, ?)",
+            [(speech_id, keyword) for keyword in str(speech_keywords).split(KEYWORD_SEPARATOR)])
+
+    def __remove_speech(self, speech_id):
+        # An external content fts5 table is told which rows to remove with the special 'delete' insert
+        self.__connection.execute(
+            "INSERT INTO sentence_text_index (sentence_text_index, rowid, sentence_text) "
+            "SELECT 'delete', sentence_id, sentence_text FROM sentences WHERE speech_id = ?", (speech_id,))
+        self.__connection.execute("DELETE FROM sentences WHERE speech_id = ?", (speech_id,))
+        self.__connection.execute("DELETE FROM speech_keywords WHERE speech_id = ?", (speech_id,))
+        self.__connection.execute("DELETE FROM speeches WHERE speech_id = ?", (speech_id,))
@@ -0,0 +1,131 @@
+import threading
+from datetime import timedelta
+
+from api_client import get_default_client
+from run_metrics import get_metrics
+from speech_search import get_search_url, iter_search_results
+
+
+def get_date_windows(date_start=None, date_end=None, window_days=None):
+    # Splits date_start..date_end into consecutive windows of window_days, the last window can be shorter.
+    # Without window_days or either date the whole range is one window
+    if window_days is None or date_start is None or date_end is None or date_start >= date_end:
+        return [(date_start, date_end)]
+    windows = []
+    window_start = date_start
+    while window_start < date_end:
+        window_end = min(window_start + timedelta(days=window_days), date_end)
+        windows.append((window_start, window_end))
+        window_start = window_end
+    return windows
+
+
+def get_media_id(speech_raw_json):
+    # The media id, e.g. DE-0200028012, is the same whichever search returned the speech
+    return speech_raw_json["data"]["id"]
+
+
+class CrawlPlanner:
+    queries = None
+    limit = None
+    window_days = None
+
+    def __init__(self, queries, limit=None, date_start=None, date_end=None, window_days=None, api_client=None):
+        # queries is a list of (keyword, faction_id) pairs, every pair is searched in every date window.
+        # limit is the number of hits per pair across all of its windows
+        self.queries = queries
+        self.limit = limit
+        self.window_days = window_days
+        self.api_client = api_client if api_client is not None else get_default_client()
+        self.__windows = get_date_windows(date_start, date_end, window_days)
+        self.__keyword_count = len({keyword for keyword, _ in queries})
+        self.__speech_keywords = None
+        self.__speech_windows = None
+        self.__query_hits = None
+        self.__finished_windows = 0
+        self.__lock = threading.Lock()
+
+    def iter_speeches(self):
+        # Yields (keywords, speech_raw_json) once per media id, as soon as the speech is first found, in a single
+        # pass over the search results. keywords is the list the planner keeps adding to when later queries find
+        # the same speech, use get_keywords once is_final is true to get all of them
+        with self.__lock:
+            self.__speech_keywords = {}
+            self.__speech_windows = {}
+            self.__query_hits = []
+            self.__finished_windows = 0
+        pair_hits = {}
+        for window_index, (window_start, window_end) in enumerate(self.__windows):
+            # The first pages of a window's queries are downloaded together, later pages while reading the results
+            query_urls = [get_search_url(keyword, window_start, window_end, faction_id, self.api_client.api_base_url)
+                          for keyword, faction_id in self.queries]
+            first_pages_raw_json = self.api_client.get_json_many(query_urls)
+
+            for (keyword, faction_id), first_page_raw_json in zip(self.queries, first_pages_raw_json):
+                remaining_hits = None if self.limit is None else self.limit - \
+                    pair_hits.get((keyword, faction_id), 0)
+                query_hits = 0
+                if remaining_hits is None or remaining_hits > 0:
+                    for speech_raw_json in iter_search_results(keyword, remaining_hits, window_start, window_end,
+                                                               faction_id, self.api_client,
+                                                               first_page_raw_json=first_page_raw_json):
+                        query_hits += 1
+                        media_id = get_media_id(speech_raw_json)
+                        with self.__lock:
+                            keywords = self.__speech_keywords.get(media_id)
+                            is_new = keywords is None
+                            if is_new:
+                                keywords = self.__speech_keywords[media_id] = [keyword]
+                                self.__speech_windows[media_id] = window_index
+                            elif keyword not in keywords:
+                                keywords.append(keyword)
+                        if is_new:
+                            yield keywords, speech_raw_json
+                pair_hits[(keyword, faction_id)] = pair_hits.get(
+                    (keyword, faction_id), 0) + query_hits
+                with self.__lock:
+                    self.__query_hits.append(query_hits)
+
+            with self.__lock:
+                self.__finished_windows = window_index + 1
+
+        get_metrics().set("crawl", self.get_stats())
+
+    def is_final(self, media_id):
+        # Whether no later query can add a keyword to the speech. Adjacent windows share their boundary, so a speech
+        # can still be found by the window after the one it was first found in
+        with self.__lock:
+            keywords = self.__speech_keywords.get(media_id)
+            if keywords is None:
+                raise ValueError("Speech " + media_id + " was not found by the crawl")
+            if len(keywords) == self.__keyword_count:
+                return True
+            last_window = min(self.__speech_windows[media_id] + 2, len(self.__windows))
+            return self.__finished_windows >= last_window
+
+    def get_keywords(self, media_id):
+        # The keywords found so far for a speech, in query order
+        with self.__lock:
+            return list(self.__speech_keywords[media_id])
+
+    def get_speech_keywords(self):
+        # A dict from media id to the keywords that found the speech
+        with self.__lock:
+            return {media_id: list(keywords) for media_id, keywords in self.__speech_keywords.items()}
+
+    def get_stats(self):
+        if self.__query_hits is None:
+            raise ValueError("Must crawl before getting stats")
+        with self.__lock:
+            return {
+                "window_queries": len(self.__query_hits),
+                "hits": sum(self.__query_hits),
+                "unique_speeches": len(self.__speech_keywords),
+                "multi_keyword_speeches": sum(len(keywords) > 1 for keywords in self.__speech_keywords.values())
+            }
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print("Crawled " + str(stats["window_queries"]) + " queries with " + str(stats["hits"]) +
+              " hits for " + str(stats["unique_speeches"]) + " unique speeches, " +
+              str(stats["multi_keyword_speeches"]) + " matching more than one keyword")
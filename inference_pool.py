@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+
+from sentiment_inference import DEFAULT_BATCH_SIZE
+
+DEFAULT_MODEL_NAME = "oliverguhr/german-sentiment-bert"
+
+# The model that was loaded by this worker process, see init_worker
+worker_sentiment_model = None
+
+
+def create_sentiment_model(model_name=DEFAULT_MODEL_NAME):
+    # Imported here so the parent process does not need to load torch
+    from germansentiment import SentimentModel
+    return SentimentModel(model_name)
+
+
+def init_worker(model_factory, threads_per_worker):
+    global worker_sentiment_model
+    # The thread limits have to be set before torch is imported by the model factory
+    for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+        os.environ[variable] = str(threads_per_worker)
+    try:
+        import torch
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+    worker_sentiment_model = model_factory()
+
+
+def predict_batch(batch):
+    return worker_sentiment_model.predict_sentiment(batch, True)
+
+
+class SentimentModelPool:
+    workers = None
+    threads_per_worker = None
+    batch_size = DEFAULT_BATCH_SIZE
+
+    def __init__(self, workers=None, model_factory=create_sentiment_model, threads_per_worker=None,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        # Every worker loads its own model once at startup, model_factory has to be picklable
+        if workers is None:
+            workers = os.cpu_count()
+        if threads_per_worker is None:
+            threads_per_worker = max(1, os.cpu_count() // workers)
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.batch_size = batch_size
+        # spawn instead of fork, so workers never inherit a half initialised torch from the parent
+        self.__executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                              initializer=init_worker, initargs=(model_factory, threads_per_worker))
+
+    def predict_batches(self, batches):
+        # Batches are scored by the workers in parallel, the results are returned in the order of batches
+        return list(self.__executor.map(predict_batch, batches))
+
+    def predict_sentiment(self, texts, output_probabilities=False):
+        # Same interface as SentimentModel.predict_sentiment, so the pool can be used in its place
+        batches = [texts[i:i + self.batch_size]
+                   for i in range(0, len(texts), self.batch_size)]
+        sentiment_scores = []
+        sentiment_weights = []
+        for result in self.predict_batches(batches):
+            sentiment_scores += result[0]
+            sentiment_weights += result[1]
+        if output_probabilities:
+            return sentiment_scores, sentiment_weights
+        return sentiment_scores
+
+    def close(self):
+        self.__executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def create_sentiment_model_pool(workers=None, model_name=DEFAULT_MODEL_NAME, threads_per_worker=None):
+    return SentimentModelPool(workers, partial(create_sentiment_model, model_name), threads_per_worker)
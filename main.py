@@ -1,13 +1,9 @@
-
+import argparse
 import os
-from germansentiment import SentimentModel
-from categorised_speech_group import CategorisedSpeechGroup
-from speech import Speech
-import requests
-import pandas as pd
-import urllib.parse
 from datetime import datetime
-import matplotlib.pyplot as plt
+
+# Only light modules are imported here. pandas, matplotlib and the sentiment model are imported by the
+# subcommands that need them, so e.g. plot never loads the model
 
 faction_ids = {
     "CDU/CSU": "Q1023134",
@@ -19,95 +15,248 @@ faction_ids = {
     "fraktionslos": "Q4316268",
 }
 
+DEFAULT_KEYWORDS = ["Europäische Union"]
+DEFAULT_SPEECHES_PER_KEYWORD = 5
+DEFAULT_DATE_START = "2022-01-01"
+DEFAULT_DATE_END = "2023-05-01"
+DEFAULT_SENTIMENT_MODEL_ID = "oliverguhr/german-sentiment-bert"
+DEFAULT_CORPUS_INDEX_PATH = "./results/corpus_index.sqlite"
 
-def get_timestamp_from_datetime(dt):
-    epoch = datetime.utcfromtimestamp(0)
-    return int((dt - epoch).total_seconds() * 1000.0)
-
-
-def get_speeches_by_query(query, limit=None, date_start=None, date_end=None, faction_id=None):
-    base_url = "https://de.openparliament.tv/api/v1/search/media"
-    parsed_query = urllib.parse.quote(query)
-    print(parsed_query)
-    query_url = base_url + "?q=" + parsed_query
-    if date_start is not None:
-        date_start_millis = get_timestamp_from_datetime(
-            date_start)
-        date_start_string = str(date_start_millis)
-        query_url += "&dateFrom=" + date_start_string
-    if date_end is not None:
-        date_end_millis = get_timestamp_from_datetime(
-            date_end)
-        date_end_string = str(date_end_millis)
-        query_url += "&dateTo=" + date_end_string
-    if faction_id is not None:
-        query_url += "&factionID=" + urllib.parse.quote(faction_id)
-    print(query_url)
-    speeches_raw_json = requests.get(query_url).json()
-    speeches = []
-
-    current_speech = 0
-    if "data" not in speeches_raw_json:
-        print("No speeches found for query " + query)
-        return speeches
-
-    for speech_data in speeches_raw_json["data"]:
-        if limit is not None and current_speech >= limit:
-            break
-        current_speech += 1
-        speech_data_formatted = {}
-        speech_data_formatted["data"] = speech_data
-
-        speech = Speech(speech_raw_json=speech_data_formatted)
-        speech.set_keyword(query)
-        speeches.append(speech)
-
-    return speeches
-
-
-def main():
-    # keywords = ["Ausländer",
-    #             "Budget", "Covid",
-    #             "Europäische Union", "Gesundheit"]
-
-    keywords = ["Europäische Union"]
-
-    speeches_per_keyword = 5
-
-    sentiment_model = SentimentModel()
-
-    date_start = datetime(2022, 1, 1)
-    date_end = datetime(2023, 5, 1)
-
-    # make directory to output all results
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    results_dir = "./results/" + timestamp
-    os.mkdir(results_dir)
-
-    all_speeches = []
-    for faction in faction_ids:
+
+def get_queries(keywords, factions):
+    queries = []
+    for faction in factions:
         faction_label = faction
         faction_id = faction_ids[faction]
         for keyword in keywords:
             print("Getting speeches for keyword " +
                   keyword + " and faction " + faction_label)
-            speeches = get_speeches_by_query(
-                keyword, speeches_per_keyword, date_start, date_end, faction_id)
-            all_speeches += speeches
-
-    all_speech_summaries = pd.DataFrame()
-
-    for speech in all_speeches:
-        speech.analyse_sentiment(sentiment_model)
-        speech_summary = speech.generate_summary()
-        if speech_summary is not None:
-            # Delete speech if it has no sentences, this is caused by their being no main speaker
-            speech.write_speech_df_to_csv(
-                results_dir + "/" + speech.get_id() + ".csv")
-            all_speech_summaries = pd.concat([all_speech_summaries, speech_summary],
-                                             ignore_index=False)
+            queries.append((keyword, faction_id))
+    return queries
+
+
+def create_results_dir(incremental=False):
+    # In incremental mode every run writes to the same directory
+    if incremental:
+        results_dir = "./results/incremental"
+        os.makedirs(results_dir, exist_ok=True)
+    else:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        results_dir = "./results/" + timestamp
+        os.mkdir(results_dir)
+    return results_dir
+
+
+def set_up_api_client(args):
+    from api_client import OpenParliamentClient, set_default_client
+    set_default_client(OpenParliamentClient(offline=args.offline))
+
+
+def fetch(args):
+    # Downloads the raw speech json into the http cache and output_dir, without loading pandas or the model
+    import json
+    from api_client import get_default_client
+    from crawl_planner import CrawlPlanner, get_media_id
+
+    set_up_api_client(args)
+    output_dir = args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    speeches_raw_json = []
+    if args.urls is not None:
+        speeches_raw_json += get_default_client().get_json_many(args.urls)
+    else:
+        # Every speech is written once, the keywords that found each speech are written to speech_keywords.json
+        crawl_planner = CrawlPlanner(get_queries(args.keywords, args.factions), args.limit, args.date_start,
+                                     args.date_end, args.window_days)
+        speeches_raw_json += [speech_raw_json for _, speech_raw_json in crawl_planner.iter_speeches()]
+        crawl_planner.print_stats()
+        with open(os.path.join(output_dir, "speech_keywords.json"), "w", encoding="utf-8") as keywords_file:
+            json.dump(crawl_planner.get_speech_keywords(), keywords_file, ensure_ascii=False)
+
+    for speech_raw_json in speeches_raw_json:
+        with open(os.path.join(output_dir, get_media_id(speech_raw_json) + ".json"), "w",
+                  encoding="utf-8") as speech_file:
+            json.dump(speech_raw_json, speech_file, ensure_ascii=False)
+    print("Fetched " + str(len(speeches_raw_json)) +
+          " speeches into " + output_dir)
+
+
+def score(args):
+    from inference_pool import create_sentiment_model_pool
+    from pipeline import SpeechPipeline
+    from run_manifest import RunManifest
+    from run_metrics import reset_metrics
+    from sentiment_cache import SentimentCache
+
+    # Stages can be profiled by setting PIPELINE_PROFILE_STAGES, e.g. PIPELINE_PROFILE_STAGES=parse,infer,
+    # one stage is profiled at a time, see run_metrics.py
+    run_metrics = reset_metrics()
 
+    # A running scoring service (see serve) keeps the model loaded between runs, otherwise the number of
+    # processes used for inference, 1 runs the model in this process
+    if args.scoring_service is not None:
+        from scoring_service import ScoringServiceClient
+        sentiment_model = ScoringServiceClient(args.scoring_service)
+    elif args.inference_workers > 1:
+        sentiment_model = create_sentiment_model_pool(
+            args.inference_workers, args.model)
+    else:
+        from germansentiment import SentimentModel
+        sentiment_model = SentimentModel(args.model)
+
+    # Rebuild after changing the model to rescore every sentence instead of using cached results
+    sentiment_cache = SentimentCache(args.model)
+    if args.rebuild_sentiment_cache:
+        sentiment_cache.clear()
+    # Results of other models are kept unless asked for, so switching back to an earlier model stays cheap
+    if args.evict_other_models:
+        sentiment_cache.evict_other_models()
+
+    set_up_api_client(args)
+
+    # In incremental mode speeches that are unchanged since an earlier run are skipped and a killed run
+    # resumes where it stopped
+    results_dir = create_results_dir(args.incremental)
+    run_manifest = None
+    if args.incremental:
+        run_manifest = RunManifest(
+            results_dir + "/manifest.jsonl", args.model)
+
+    # Written speeches are also added to the local full text index, which the query subcommand searches
+    corpus_index = None
+    if args.corpus_index is not None:
+        from corpus_index import CorpusIndex
+        corpus_index = CorpusIndex(args.corpus_index)
+
+    queries = get_queries(args.keywords, args.factions)
+
+    # Fetching, parsing, scoring and writing run concurrently, see pipeline.py
+    speech_pipeline = SpeechPipeline(
+        sentiment_model, results_dir, sentiment_cache=sentiment_cache, output_formats=args.output_formats,
+        run_manifest=run_manifest, summary_only=args.summary_only, chunk_speeches=args.chunk_speeches,
+        corpus_index=corpus_index)
+    all_speech_summaries = speech_pipeline.run(
+        queries, args.limit, args.date_start, args.date_end, args.window_days)
+
+    # speech_keyword is the primary keyword of each speech, speech_keywords every keyword that found it
     all_speech_summaries.to_csv(results_dir + "/master_summary.csv")
+    # Faction, party, keywords, speaker and month totals of the speeches in the master summary, see
+    # sentiment_aggregates.py
+    speech_pipeline.get_aggregates().write_json(results_dir + "/aggregates.json")
+
+    sentiment_cache.print_stats()
+    run_metrics.set("sentiment_cache", sentiment_cache.get_stats())
+    run_metrics.write_json(results_dir + "/metrics.json")
+    sentiment_cache.close()
+    if corpus_index is not None:
+        corpus_index.print_stats()
+        corpus_index.close()
+    if args.scoring_service is None and args.inference_workers > 1:
+        sentiment_model.close()
+
+    if not args.no_plot:
+        plot_summaries(all_speech_summaries,
+                       results_dir + "/scatter_plot.png")
+
+
+def serve(args):
+    from germansentiment import SentimentModel
+    from scoring_service import ScoringService
+
+    # Keeps one model loaded and merges the sentences of concurrent requests into micro batches
+    scoring_service = ScoringService(SentimentModel(args.model), args.host, args.port,
+                                     args.max_batch_size, args.max_wait_ms)
+    print("Scoring service listening on " + scoring_service.get_url())
+    try:
+        scoring_service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def summarize(args):
+    # Rebuilds master_summary.csv from the per speech csvs of an earlier run, without loading the model
+    import glob
+    import pandas as pd
+    from speech_summary import SUMMARY_INPUT_COLUMNS, generate_summaries
+
+    speech_csv_paths = sorted(
+        glob.glob(os.path.join(args.results_dir, "ID*.csv")))
+    if len(speech_csv_paths) == 0:
+        raise ValueError("No speech csvs found in " + args.results_dir)
+
+    sentences_df = pd.concat([pd.read_csv(speech_csv_path,
+                                          usecols=lambda column: column in SUMMARY_INPUT_COLUMNS)
+                              for speech_csv_path in speech_csv_paths], ignore_index=True)
+    # Csvs written before speeches were deduplicated across keywords only have speech_keyword
+    if "speech_keywords" not in sentences_df:
+        sentences_df["speech_keywords"] = sentences_df["speech_keyword"]
+    all_speech_summaries = generate_summaries(sentences_df)
+
+    output_path = args.output if args.output is not None else os.path.join(
+        args.results_dir, "master_summary.csv")
+    all_speech_summaries.to_csv(output_path)
+    print("Summarised " + str(len(all_speech_summaries)) +
+          " speeches into " + output_path)
+
+
+def index(args):
+    # Adds the speech csvs of earlier runs to the local full text index, speeches that are already indexed
+    # unchanged are skipped
+    from corpus_index import CorpusIndex
+
+    corpus_index = CorpusIndex(args.index_path)
+    for results_dir in args.results_dirs:
+        print("Indexed " + str(corpus_index.add_results_dir(results_dir)) +
+              " new or changed speeches from " + results_dir)
+    corpus_index.print_stats()
+    corpus_index.close()
+
+
+def query(args):
+    # Searches the local full text index and rolls the sentiment of the matching sentences up, without any api
+    # or model calls
+    import pandas as pd
+    from corpus_index import CorpusIndex
+
+    corpus_index = CorpusIndex(args.index_path)
+    try:
+        rollup_df = corpus_index.get_sentiment_rollup(
+            args.query, args.group_by, args.factions, args.date_start, args.date_end, not args.all_speakers)
+    except ValueError as error:
+        corpus_index.close()
+        raise SystemExit(str(error) + '\nUse plain words, "quoted phrases", prefixes like Klima* and AND, OR, NOT')
+    with pd.option_context("display.max_columns", None, "display.width", 200):
+        print(rollup_df)
+        if args.sentences != 0:
+            print(corpus_index.search_sentences(
+                args.query, args.factions, args.date_start, args.date_end, not args.all_speakers,
+                args.sentences)[["speech_date_start", "sentence_speaker", "sentence_speaker_faction",
+                                 "sentence_sentiment_score", "sentence_text"]])
+    if args.output is not None:
+        rollup_df.to_csv(args.output)
+        print("Rollup written to " + args.output)
+    corpus_index.close()
+
+
+def plot(args):
+    import pandas as pd
+
+    summary_path = args.summary
+    if os.path.isdir(summary_path):
+        summary_path = os.path.join(summary_path, "master_summary.csv")
+    output_path = args.output if args.output is not None else os.path.join(
+        os.path.dirname(summary_path), "scatter_plot.png")
+
+    plot_summaries(pd.read_csv(summary_path), output_path)
+    print("Plot written to " + output_path)
+
+
+def plot_summaries(all_speech_summaries, output_path):
+    import matplotlib
+    # Plots are only saved, so no display is needed
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
     # Now create a scatter plot using the postive and negative percent scores, each party should have a different colour with a single dot for each speech
     unique_factions = all_speech_summaries["main_speaker_faction"].unique()
@@ -127,9 +276,128 @@ def main():
     plt.xlabel("Percentage of speech that is positive")
     plt.ylabel("Percentage of speech that is negative")
 
-    plt.savefig(results_dir + "/scatter_plot.png")
+    plt.savefig(output_path)
+    plt.close()
+
+
+def parse_date(date_string):
+    return datetime.strptime(date_string, "%Y-%m-%d")
+
+
+def add_query_arguments(parser):
+    parser.add_argument("--keywords", nargs="+", default=DEFAULT_KEYWORDS)
+    parser.add_argument("--factions", nargs="+", default=list(faction_ids),
+                        choices=list(faction_ids), metavar="FACTION")
+    parser.add_argument("--date-start", type=parse_date, default=parse_date(DEFAULT_DATE_START),
+                        help="YYYY-MM-DD")
+    parser.add_argument("--date-end", type=parse_date, default=parse_date(DEFAULT_DATE_END),
+                        help="YYYY-MM-DD")
+    parser.add_argument("--limit", type=int, default=DEFAULT_SPEECHES_PER_KEYWORD,
+                        help="maximum number of speeches per keyword and faction")
+    parser.add_argument("--window-days", type=int, default=None,
+                        help="split the date range into windows of this many days and search each window")
+    parser.add_argument("--offline", action="store_true",
+                        help="serve every api request from the http cache or api_data fixtures")
+
+
+def get_argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Sentiment analysis of German Bundestag speeches from openparliament.tv")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser = subparsers.add_parser(
+        "fetch", help="download raw speech json without scoring it")
+    add_query_arguments(fetch_parser)
+    fetch_parser.add_argument("--urls", nargs="+", default=None,
+                              help="media api urls to fetch instead of searching, e.g. from speeches.py")
+    fetch_parser.add_argument("--output-dir", default="./results/raw")
+    fetch_parser.set_defaults(handler=fetch)
+
+    score_parser = subparsers.add_parser(
+        "score", help="fetch, score and summarise speeches")
+    add_query_arguments(score_parser)
+    score_parser.add_argument("--model", default=DEFAULT_SENTIMENT_MODEL_ID)
+    score_parser.add_argument("--inference-workers", type=int, default=1,
+                              help="number of processes used for inference, 1 runs the model in this process")
+    score_parser.add_argument("--rebuild-sentiment-cache", action="store_true",
+                              help="rescore every sentence instead of using cached results")
+    score_parser.add_argument("--evict-other-models", action="store_true",
+                              help="remove cached results that were scored by any other model")
+    score_parser.add_argument("--incremental", action="store_true",
+                              help="skip speeches that are unchanged since an earlier run and resume killed runs")
+    score_parser.add_argument("--output-formats", nargs="+", default=["csv"], choices=["csv", "parquet"],
+                              help="csv writes one csv per speech, parquet writes normalised tables to "
+                              "./results/dataset")
+    score_parser.add_argument("--chunk-speeches", type=int, default=None,
+                              help="summarise and release sentences every N speeches, so memory stays flat for "
+                              "corpus scale runs")
+    score_parser.add_argument("--summary-only", action="store_true",
+                              help="only score the main speaker's speech, which is all the summary uses. Other "
+                              "rows are left unscored, see the sentence_scored column of the speech csvs")
+    score_parser.add_argument("--scoring-service", default=None,
+                              help="url of a running scoring service, e.g. http://127.0.0.1:8765, used instead "
+                              "of loading the model")
+    score_parser.add_argument("--corpus-index", nargs="?", const=DEFAULT_CORPUS_INDEX_PATH, default=None,
+                              help="also add the scored speeches to the local full text index, by default "
+                              + DEFAULT_CORPUS_INDEX_PATH)
+    score_parser.add_argument("--no-plot", action="store_true")
+    score_parser.set_defaults(handler=score)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="run a local scoring service that keeps the model loaded")
+    serve_parser.add_argument("--model", default=DEFAULT_SENTIMENT_MODEL_ID)
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--max-batch-size", type=int, default=64,
+                              help="maximum number of sentences scored together")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=10,
+                              help="how long the first request of a batch waits for more sentences")
+    serve_parser.set_defaults(handler=serve)
+
+    summarize_parser = subparsers.add_parser(
+        "summarize", help="rebuild master_summary.csv from the speech csvs of a results directory")
+    summarize_parser.add_argument("results_dir")
+    summarize_parser.add_argument("--output", default=None)
+    summarize_parser.set_defaults(handler=summarize)
+
+    plot_parser = subparsers.add_parser(
+        "plot", help="plot a master_summary.csv or results directory")
+    plot_parser.add_argument("summary")
+    plot_parser.add_argument("--output", default=None)
+    plot_parser.set_defaults(handler=plot)
+
+    index_parser = subparsers.add_parser(
+        "index", help="add the speech csvs of results directories to the local full text index")
+    index_parser.add_argument("results_dirs", nargs="+")
+    index_parser.add_argument("--index-path", default=DEFAULT_CORPUS_INDEX_PATH)
+    index_parser.set_defaults(handler=index)
+
+    query_parser = subparsers.add_parser(
+        "query", help="search the local full text index and roll up the sentiment of the matching sentences")
+    query_parser.add_argument("query", nargs="?", default=None,
+                              help='fts5 query, e.g. Migration, "Europäische Union" or Klima*, leave out to '
+                              "roll up every sentence")
+    query_parser.add_argument("--factions", nargs="+", default=None)
+    query_parser.add_argument("--date-start", type=parse_date, default=None, help="YYYY-MM-DD")
+    query_parser.add_argument("--date-end", type=parse_date, default=None, help="YYYY-MM-DD")
+    query_parser.add_argument("--group-by", nargs="*", default=["sentence_speaker_faction"],
+                              choices=["sentence_speaker", "sentence_speaker_party", "sentence_speaker_faction",
+                                       "speech_keyword", "speech_id", "speech_date", "speech_month"],
+                              help="speech_keyword counts a speech under every keyword that found it")
+    query_parser.add_argument("--all-speakers", action="store_true",
+                              help="include interjections and comments, not only the main speaker's speech")
+    query_parser.add_argument("--sentences", type=int, default=5,
+                              help="number of matching sentences to print")
+    query_parser.add_argument("--output", default=None, help="write the rollup as csv")
+    query_parser.add_argument("--index-path", default=DEFAULT_CORPUS_INDEX_PATH)
+    query_parser.set_defaults(handler=query)
+
+    return parser
+
 
-    plt.show()
+def main(argv=None):
+    args = get_argument_parser().parse_args(argv)
+    args.handler(args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+import os
+import urllib.parse
+import uuid
+
+import pandas as pd
+
+from speech import KEYWORD_SEPARATOR
+
+DEFAULT_DATASET_DIR = "./results/dataset"
+
+OUTPUT_FORMATS = ["csv", "parquet"]
+
+# Columns that are the same for every sentence of a speech, stored once per speech in the speeches table
+SPEECH_COLUMNS = ["speech_id", "speech_url", "speech_keyword", "speech_keywords", "speech_duration",
+                  "speech_date_start", "speech_date_end", "speech_agenda_item_title"]
+
+SENTENCE_COLUMNS = ["speech_id", "sentence_index", "sentence_speaker", "sentence_speaker_status",
+                    "sentence_speaker_party", "sentence_speaker_faction", "sentence_type", "sentence_text",
+                    "sentence_time_start", "sentence_time_end", "sentence_duration", "sentence_sentiment_score",
+                    "sentence_sentiment_positive_weight", "sentence_sentiment_negative_weight",
+                    "sentence_sentiment_neutral_weight", "sentence_scored"]
+
+# Repeated strings that are stored dictionary encoded
+CATEGORICAL_COLUMNS = {
+    "speeches": ["speech_agenda_item_title"],
+    "sentences": ["speech_id", "sentence_speaker", "sentence_speaker_status", "sentence_speaker_party",
+                  "sentence_speaker_faction", "sentence_type", "sentence_sentiment_score"],
+    "summaries": ["speech_agenda_item_title", "main_speaker", "main_speaker_party", "main_speaker_faction"]
+}
+
+TABLES = list(CATEGORICAL_COLUMNS)
+
+# Number of buffered sentences after which the parquet writer writes a part file
+DEFAULT_FLUSH_SENTENCES = 50000
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(
+            "pyarrow is required for parquet output, install it with pip install pyarrow")
+    return pyarrow
+
+
+def split_speech_df(speech_df):
+    # Splits a denormalised speech dataframe into one speeches row and the sentence rows
+    speech_rows = speech_df[SPEECH_COLUMNS].drop_duplicates("speech_id")
+    sentence_rows = speech_df.assign(
+        sentence_index=range(len(speech_df)))[SENTENCE_COLUMNS]
+    return speech_rows, sentence_rows
+
+
+def get_partition_dir(dataset_dir, table, run_id, keyword):
+    # Hive style partition directories, the values are uri encoded because keywords contain spaces and umlauts
+    return os.path.join(dataset_dir, table, "run=" + urllib.parse.quote(str(run_id), safe=""),
+                        "keyword=" + urllib.parse.quote(str(keyword), safe=""))
+
+
+class ParquetSpeechWriter:
+    dataset_dir = None
+    run_id = None
+    flush_sentences = DEFAULT_FLUSH_SENTENCES
+
+    def __init__(self, run_id, dataset_dir=DEFAULT_DATASET_DIR, flush_sentences=DEFAULT_FLUSH_SENTENCES):
+        import_pyarrow()
+        self.run_id = run_id
+        self.dataset_dir = dataset_dir
+        self.flush_sentences = flush_sentences
+        self.__buffers = {table: [] for table in TABLES}
+        self.__buffered_sentences = 0
+        self.__part_numbers = {}
+        self.__part_paths = {table: [] for table in TABLES}
+        self.__speech_keywords = {}
+        # Part files of different writers never overwrite each other, even when the run id is reused
+        self.__writer_id = uuid.uuid4().hex[:8]
+
+    def add_speech(self, speech_df):
+        speech_rows, sentence_rows = split_speech_df(speech_df)
+        self.__buffers["speeches"].append(speech_rows)
+        # The keyword is only needed to pick the partition, it is not stored in the sentences table
+        self.__buffers["sentences"].append(sentence_rows.assign(
+            speech_keyword=speech_df["speech_keyword"].to_numpy()))
+
+        self.__buffered_sentences += len(sentence_rows)
+        if self.__buffered_sentences >= self.flush_sentences:
+            self.flush()
+
+    def add_summaries(self, speech_summaries_df):
+        # speech_summaries_df is indexed by speech id, see speech_summary.generate_summaries
+        if speech_summaries_df.empty:
+            return
+        self.__buffers["summaries"].append(speech_summaries_df.reset_index())
+
+    def flush(self):
+        for table in TABLES:
+            if len(self.__buffers[table]) != 0:
+                self.__write_table(table, pd.concat(
+                    self.__buffers[table], ignore_index=True))
+            self.__buffers[table] = []
+        self.__buffered_sentences = 0
+
+    def set_speech_keywords(self, speech_keywords):
+        # speech_keywords maps speech ids to keywords that were found after the speech was added, they are
+        # written to the speeches and summaries tables on close. The partitions still use the primary keyword
+        self.__speech_keywords.update(speech_keywords)
+
+    def close(self):
+        self.flush()
+        if len(self.__speech_keywords) == 0:
+            return
+        # Only this writer's part files are rewritten, the sentences table has no keyword columns
+        pyarrow = import_pyarrow()
+        speech_keywords = {speech_id: KEYWORD_SEPARATOR.join(keywords)
+                           for speech_id, keywords in self.__speech_keywords.items()}
+        for table in ["speeches", "summaries"]:
+            for part_path in self.__part_paths[table]:
+                part_df = pyarrow.parquet.read_table(part_path).to_pandas()
+                is_updated = part_df["speech_id"].isin(speech_keywords)
+                if not is_updated.any():
+                    continue
+                part_df.loc[is_updated, "speech_keywords"] = part_df.loc[is_updated, "speech_id"].map(
+                    speech_keywords)
+                pyarrow.parquet.write_table(pyarrow.Table.from_pandas(part_df, preserve_index=False), part_path)
+        self.__speech_keywords = {}
+
+    def __write_table(self, table, table_df):
+        pyarrow = import_pyarrow()
+
+        for keyword, keyword_df in table_df.groupby("speech_keyword", dropna=False, sort=False):
+            keyword_df = keyword_df.drop(columns=["speech_keyword"])
+            for column in CATEGORICAL_COLUMNS[table]:
+                keyword_df[column] = keyword_df[column].astype("category")
+
+            partition_dir = get_partition_dir(
+                self.dataset_dir, table, self.run_id, keyword)
+            os.makedirs(partition_dir, exist_ok=True)
+            part_number = self.__part_numbers.get(partition_dir, 0)
+            self.__part_numbers[partition_dir] = part_number + 1
+
+            part_path = os.path.join(partition_dir, "part-" + self.__writer_id + "-" + str(part_number) + ".parquet")
+            pyarrow.parquet.write_table(pyarrow.Table.from_pandas(keyword_df, preserve_index=False), part_path)
+            self.__part_paths[table].append(part_path)
+
+
+def load_table(table, dataset_dir=DEFAULT_DATASET_DIR, columns=None, run_id=None, keyword=None):
+    # Only the requested columns and partitions are read from disk.
+    # The run and keyword partition values are returned as the run_id and speech_keyword columns
+    pyarrow = import_pyarrow()
+    dataset = pyarrow.dataset.dataset(os.path.join(dataset_dir, table), format="parquet",
+                                      partitioning="hive")
+    # Part files of older runs can lack columns that were added later, e.g. sentence_scored. The schemas of
+    # all part files are merged, so those columns are read as null instead of being dropped
+    dataset = pyarrow.dataset.dataset(os.path.join(dataset_dir, table), format="parquet", partitioning="hive",
+                                      schema=pyarrow.unify_schemas(
+                                          [dataset.schema] + [fragment.physical_schema
+                                                              for fragment in dataset.get_fragments()]))
+
+    partition_filter = None
+    if run_id is not None:
+        partition_filter = pyarrow.dataset.field("run") == str(run_id)
+    if keyword is not None:
+        keyword_filter = pyarrow.dataset.field("keyword") == str(keyword)
+        partition_filter = keyword_filter if partition_filter is None else partition_filter & keyword_filter
+
+    if columns is not None:
+        partition_columns = {"run_id": "run", "speech_keyword": "keyword"}
+        columns = [partition_columns.get(column, column) for column in columns]
+
+    table_df = dataset.to_table(
+        columns=columns, filter=partition_filter).to_pandas()
+    return table_df.rename(columns={"run": "run_id", "keyword": "speech_keyword"})
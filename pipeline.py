@@ -0,0 +1,444 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from api_client import get_default_client
+from crawl_planner import CrawlPlanner, get_media_id
+from output_store import DEFAULT_DATASET_DIR, OUTPUT_FORMATS, ParquetSpeechWriter
+from sentiment_aggregates import SentimentAggregates, get_speech_aggregate
+from sentiment_inference import analyse_speeches_sentiment
+from speech import KEYWORD_SEPARATOR, Speech
+from speech_summary import SUMMARY_INPUT_COLUMNS, generate_speech_summary, generate_summaries, \
+    get_main_speaker_sentences
+from run_manifest import get_speech_content_hash
+from run_metrics import get_metrics
+
+# Maximum number of items waiting between two stages, a full queue blocks the stage in front of it
+DEFAULT_QUEUE_SIZE = 16
+
+# Maximum number of speeches scored together by the inference stage
+DEFAULT_INFERENCE_BATCH_SPEECHES = 8
+
+# Put on a queue after the last item, so the next stage knows the stage in front of it has finished
+END_OF_STREAM = object()
+
+# Seconds between checks whether another stage has failed while waiting on a queue
+QUEUE_POLL_SECONDS = 0.1
+
+
+class PipelineStopped(Exception):
+    # Raised inside a stage when another stage has failed
+    pass
+
+
+class StageStats:
+    name = None
+    items = 0
+    busy_seconds = 0
+    queue_depth_samples = 0
+    queue_depth_total = 0
+    max_queue_depth = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0
+        self.queue_depth_samples = 0
+        self.queue_depth_total = 0
+        self.max_queue_depth = 0
+
+    def record_queue_depth(self, queue_depth):
+        self.queue_depth_samples += 1
+        self.queue_depth_total += queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def get_report(self, wall_seconds):
+        mean_queue_depth = self.queue_depth_total / \
+            self.queue_depth_samples if self.queue_depth_samples != 0 else 0
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "busy_seconds": self.busy_seconds,
+            "items_per_second": self.items / wall_seconds if wall_seconds != 0 else 0,
+            "mean_input_queue_depth": mean_queue_depth,
+            "max_input_queue_depth": self.max_queue_depth
+        }
+
+
+class SpeechPipeline:
+    sentiment_model = None
+    sentiment_cache = None
+    api_client = None
+    results_dir = None
+    queue_size = DEFAULT_QUEUE_SIZE
+    inference_batch_speeches = DEFAULT_INFERENCE_BATCH_SPEECHES
+    output_formats = None
+    dataset_dir = DEFAULT_DATASET_DIR
+    run_manifest = None
+    stage_stats = None
+
+    def __init__(self, sentiment_model, results_dir, sentiment_cache=None, api_client=None,
+                 queue_size=DEFAULT_QUEUE_SIZE, inference_batch_speeches=DEFAULT_INFERENCE_BATCH_SPEECHES,
+                 output_formats=("csv",), dataset_dir=DEFAULT_DATASET_DIR, run_manifest=None, summary_only=False,
+                 chunk_speeches=None, corpus_index=None):
+        # output_formats can contain "csv" for one csv per speech in results_dir and "parquet" for the
+        # normalised speeches, sentences and summaries tables in dataset_dir, see output_store.py.
+        # With a run_manifest speeches that were already processed are skipped and every written speech
+        # is checkpointed, see run_manifest.py. With summary_only only the sentences the summaries use are scored.
+        # With chunk_speeches the summary rows are computed every chunk_speeches written speeches and their
+        # sentences are released, so memory stays flat however many speeches a run has. Otherwise the
+        # summaries are computed together at the end, which is faster for small runs.
+        # With a corpus_index every written speech is also added to the local full text index, see corpus_index.py
+        for output_format in output_formats:
+            if output_format not in OUTPUT_FORMATS:
+                raise ValueError("Unknown output format " + output_format)
+        self.sentiment_model = sentiment_model
+        self.sentiment_cache = sentiment_cache
+        self.api_client = api_client if api_client is not None else get_default_client()
+        self.results_dir = results_dir
+        self.queue_size = queue_size
+        self.inference_batch_speeches = inference_batch_speeches
+        self.output_formats = list(output_formats)
+        self.dataset_dir = dataset_dir
+        self.run_manifest = run_manifest
+        self.summary_only = summary_only
+        self.chunk_speeches = chunk_speeches
+        self.corpus_index = corpus_index
+        self.sentiment_aggregates = None
+
+    def run(self, queries, limit=None, date_start=None, date_end=None, window_days=None):
+        # queries is a list of (keyword, faction_id) pairs, searched in date windows of window_days, see
+        # crawl_planner.py. Every speech is processed once, however many queries found it. Keywords that a later
+        # query adds after the speech was written are patched into its outputs once the crawl has finished.
+        # Speeches are fetched, parsed, scored and written by one thread per stage, each speech is released as
+        # soon as its csv and summary row are written.
+        # Returns the summaries of all written speeches, including those from earlier runs with a run_manifest
+        self.__failed = threading.Event()
+        self.__errors = []
+        self.__summary_sentences = []
+        self.__summary_rows = []
+        self.__speech_summaries = []
+        self.__speech_summaries_df = None
+        # media id -> (speech id, keywords it was written with, aggregate) of speeches written before their keywords
+        # were final, and media id -> (speech id, primary keyword) of speeches skipped as unchanged
+        self.__written_keywords = {}
+        self.__unchanged_speeches = {}
+        self.sentiment_aggregates = SentimentAggregates()
+        self.__crawl_planner = CrawlPlanner(
+            queries, limit, date_start, date_end, window_days, self.api_client)
+        self.stage_stats = {stage_name: StageStats(stage_name)
+                            for stage_name in ["fetch", "parse", "infer", "write"]}
+
+        parse_queue = queue.Queue(maxsize=self.queue_size)
+        infer_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        stages = [
+            (self.__fetch_stage, (parse_queue,)),
+            (self.__parse_stage, (parse_queue, infer_queue)),
+            (self.__infer_stage, (infer_queue, write_queue)),
+            (self.__write_stage, (write_queue,))
+        ]
+
+        start_time = time.perf_counter()
+        threads = [threading.Thread(target=self.__run_stage, args=(stage, stage_args), daemon=True)
+                   for stage, stage_args in stages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start_time
+
+        if len(self.__errors) != 0:
+            raise self.__errors[0]
+
+        self.print_stats()
+        get_metrics().set("pipeline", {"wall_seconds": self.wall_seconds,
+                                       "stages": self.get_stats()})
+
+        return self.__speech_summaries_df
+
+    def get_aggregates(self):
+        # Faction, party, keyword, speaker and month totals of the speeches written by the last run, with a
+        # run_manifest of every speech processed so far, like the summaries run returns
+        return self.sentiment_aggregates
+
+    def get_stats(self):
+        return [stats.get_report(self.wall_seconds) for stats in self.stage_stats.values()]
+
+    def print_stats(self):
+        print("Pipeline finished in " + "{:.2f}".format(self.wall_seconds) + "s")
+        for report in self.get_stats():
+            print("  " + report["stage"] + ": " + str(report["items"]) + " items, " +
+                  "{:.2f}".format(report["busy_seconds"]) + "s busy, " +
+                  "{:.2f}".format(report["items_per_second"]) + " items/s, input queue depth mean " +
+                  "{:.1f}".format(report["mean_input_queue_depth"]) + " max " + str(report["max_input_queue_depth"]))
+
+    def __run_stage(self, stage, stage_args):
+        try:
+            stage(*stage_args)
+        except PipelineStopped:
+            pass
+        except Exception as error:
+            self.__errors.append(error)
+            self.__failed.set()
+
+    def __put(self, output_queue, item):
+        while True:
+            if self.__failed.is_set():
+                raise PipelineStopped()
+            try:
+                output_queue.put(item, timeout=QUEUE_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def __get(self, input_queue, stats):
+        stats.record_queue_depth(input_queue.qsize())
+        while True:
+            if self.__failed.is_set():
+                raise PipelineStopped()
+            try:
+                return input_queue.get(timeout=QUEUE_POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    @contextmanager
+    def __busy(self, stats, metrics_stage=None):
+        # Times work done by a stage. The time is also recorded in the run metrics, where the stage can be profiled
+        start = time.perf_counter()
+        with get_metrics().stage(metrics_stage if metrics_stage is not None else stats.name):
+            yield
+        stats.busy_seconds += time.perf_counter() - start
+
+    def __fetch_stage(self, output_queue):
+        stats = self.stage_stats["fetch"]
+
+        # Each speech is passed on the first time the crawl finds it, see __update_keywords for later keywords
+        speeches = self.__crawl_planner.iter_speeches()
+        while True:
+            with self.__busy(stats):
+                item = next(speeches, None)
+            if item is None:
+                break
+            stats.items += 1
+            self.__put(output_queue, item)
+        self.__crawl_planner.print_stats()
+
+        self.__put(output_queue, END_OF_STREAM)
+
+    def __parse_stage(self, input_queue, output_queue):
+        stats = self.stage_stats["parse"]
+        metrics = get_metrics()
+        unchanged_speeches = 0
+        while True:
+            item = self.__get(input_queue, stats)
+            if item is END_OF_STREAM:
+                break
+            keywords, speech_raw_json = item
+
+            with self.__busy(stats):
+                media_id = get_media_id(speech_raw_json)
+                speech = Speech(speech_raw_json=speech_raw_json)
+                speech.drop_raw_json()
+                # The primary keyword is the first keyword, later queries can only add keywords after it
+                speech.set_keywords(keywords)
+                is_unchanged = self.run_manifest is not None and self.run_manifest.is_processed(
+                    speech.get_id(), keywords[0], get_speech_content_hash(speech.get_speech_df()))
+            stats.items += 1
+            metrics.increment("speeches")
+            metrics.increment("sentences", len(speech.get_speech_df()))
+
+            if is_unchanged:
+                # Only the ids are kept, the manifest entry gets any keywords the crawl finds later
+                self.__unchanged_speeches[media_id] = (speech.get_id(), keywords[0])
+                unchanged_speeches += 1
+                continue
+            self.__put(output_queue, (media_id, speech))
+
+        if unchanged_speeches != 0:
+            print("Skipped " + str(unchanged_speeches) +
+                  " speeches that are unchanged since an earlier run")
+            metrics.increment("unchanged_speeches", unchanged_speeches)
+        self.__put(output_queue, END_OF_STREAM)
+
+    def __infer_stage(self, input_queue, output_queue):
+        stats = self.stage_stats["infer"]
+        finished = False
+        while not finished:
+            # Wait for one speech, then take whatever else is already waiting to score them together
+            items = []
+            item = self.__get(input_queue, stats)
+            while item is not END_OF_STREAM:
+                items.append(item)
+                if len(items) >= self.inference_batch_speeches or input_queue.empty():
+                    break
+                item = self.__get(input_queue, stats)
+            finished = item is END_OF_STREAM
+
+            speeches = [speech for _, speech in items]
+            if len(speeches) != 0:
+                with self.__busy(stats):
+                    analyse_speeches_sentiment(
+                        speeches, self.sentiment_model, sentiment_cache=self.sentiment_cache,
+                        summary_only=self.summary_only)
+                stats.items += len(speeches)
+
+            for item in items:
+                self.__put(output_queue, item)
+
+        self.__put(output_queue, END_OF_STREAM)
+
+    def __write_stage(self, input_queue):
+        stats = self.stage_stats["write"]
+
+        parquet_writer = None
+        if "parquet" in self.output_formats:
+            # The results directory name is the run timestamp
+            parquet_writer = ParquetSpeechWriter(os.path.basename(
+                os.path.normpath(self.results_dir)), self.dataset_dir)
+
+        skipped_speeches = 0
+        while True:
+            item = self.__get(input_queue, stats)
+            if item is END_OF_STREAM:
+                break
+            media_id, speech = item
+
+            # Speeches are written with the keywords found so far, the crawl runs ahead of inference, so usually
+            # they are already final. The keywords are read after is_final, so final keywords cannot change later
+            with self.__busy(stats):
+                is_final = self.__crawl_planner.is_final(media_id)
+                keywords = self.__crawl_planner.get_keywords(media_id)
+                speech.set_keywords(keywords)
+                speech_aggregate = self.__write_speech(speech, parquet_writer)
+                if speech_aggregate is None:
+                    skipped_speeches += 1
+                elif is_final:
+                    self.sentiment_aggregates.add_speech_aggregate(speech_aggregate)
+                else:
+                    # The aggregate is counted under the speech's keywords once they are final
+                    self.__written_keywords[media_id] = (speech.get_id(), keywords, speech_aggregate)
+            stats.items += 1
+
+            if self.chunk_speeches is not None and \
+                    len(self.__summary_sentences) + len(self.__summary_rows) >= self.chunk_speeches:
+                with self.__busy(stats, "summary"):
+                    self.__summarise_chunk(parquet_writer)
+
+        if skipped_speeches != 0:
+            print("Skipped " + str(skipped_speeches) +
+                  " speeches without a main speaker")
+            get_metrics().increment("skipped_no_main_speaker", skipped_speeches)
+
+        # Without chunk_speeches all summaries are computed together once every speech has been written
+        with self.__busy(stats, "summary"):
+            self.__summarise_chunk(parquet_writer)
+            if len(self.__speech_summaries) != 0:
+                self.__speech_summaries_df = pd.concat(self.__speech_summaries)
+            else:
+                self.__speech_summaries_df = pd.DataFrame()
+
+        with self.__busy(stats):
+            # The fetch stage has finished before the last speech arrives, so every keyword is final now
+            self.__update_keywords(parquet_writer)
+            if parquet_writer is not None:
+                parquet_writer.close()
+
+        # The master summary and the aggregates are rebuilt from what is stored for every processed speech
+        if self.run_manifest is not None:
+            with self.__busy(stats, "summary"):
+                self.__speech_summaries_df = self.run_manifest.get_summaries()
+                self.sentiment_aggregates = self.run_manifest.get_aggregates(
+                    self.sentiment_aggregates.time_bucket)
+
+    def __write_speech(self, speech, parquet_writer):
+        # Returns the speech's aggregate, see sentiment_aggregates.get_speech_aggregate, or None for speeches
+        # without a main speaker, they have no summary and are not written
+        main_speaker_sentences = get_main_speaker_sentences(
+            speech.get_speech_df())
+        if main_speaker_sentences.empty:
+            if self.run_manifest is not None:
+                self.run_manifest.add_speech(speech.get_speech_df())
+            return None
+
+        if "csv" in self.output_formats:
+            speech.write_speech_df_to_csv(
+                self.results_dir + "/" + speech.get_id() + ".csv")
+        if parquet_writer is not None:
+            parquet_writer.add_speech(speech.get_speech_df())
+        if self.corpus_index is not None:
+            self.corpus_index.add_speech(speech.get_speech_df())
+        speech_aggregate = get_speech_aggregate(speech.get_speech_df())
+        if self.run_manifest is not None:
+            # The manifest checkpoints every speech with its summary row, which is kept for the chunk's summaries
+            speech_summary_df = generate_speech_summary(main_speaker_sentences)
+            self.run_manifest.add_speech(
+                speech.get_speech_df(), speech_summary_df, speech_aggregate)
+            self.__summary_rows.append(speech_summary_df)
+        else:
+            # Only the rows the summary needs are kept, the speech itself is released
+            self.__summary_sentences.append(
+                main_speaker_sentences[SUMMARY_INPUT_COLUMNS])
+        return speech_aggregate
+
+    def __update_keywords(self, parquet_writer):
+        # Adds the keywords found after a speech was written to its csv, parquet rows, index entry, manifest
+        # entry and summary row, and adds its aggregate under the final keywords
+        speech_keywords = {}
+        for media_id, (speech_id, written_keywords, speech_aggregate) in self.__written_keywords.items():
+            keywords = self.__crawl_planner.get_keywords(media_id)
+            if keywords != written_keywords:
+                speech_keywords[speech_id] = keywords
+                speech_aggregate = dict(speech_aggregate, speech_keywords=KEYWORD_SEPARATOR.join(keywords))
+            self.sentiment_aggregates.add_speech_aggregate(speech_aggregate)
+        self.__written_keywords = {}
+        if self.run_manifest is not None:
+            for media_id, (speech_id, speech_keyword) in self.__unchanged_speeches.items():
+                self.run_manifest.set_speech_keywords(
+                    speech_id, speech_keyword, self.__crawl_planner.get_keywords(media_id))
+        self.__unchanged_speeches = {}
+        if len(speech_keywords) == 0:
+            return
+        get_metrics().increment("updated_keywords", len(speech_keywords))
+
+        for speech_id, keywords in speech_keywords.items():
+            speech_csv_path = self.results_dir + "/" + speech_id + ".csv"
+            if "csv" in self.output_formats and os.path.exists(speech_csv_path):
+                # Read as text, so every other value is written back exactly as it was
+                speech_df = pd.read_csv(speech_csv_path, dtype=str, keep_default_na=False)
+                speech_df["speech_keywords"] = KEYWORD_SEPARATOR.join(keywords)
+                speech_df.to_csv(speech_csv_path, index=False)
+            if self.corpus_index is not None:
+                self.corpus_index.set_speech_keywords(speech_id, keywords)
+            if self.run_manifest is not None:
+                self.run_manifest.set_speech_keywords(speech_id, keywords[0], keywords)
+        if parquet_writer is not None:
+            parquet_writer.set_speech_keywords(speech_keywords)
+        if self.run_manifest is None and not self.__speech_summaries_df.empty:
+            is_updated = self.__speech_summaries_df.index.isin(list(speech_keywords))
+            self.__speech_summaries_df.loc[is_updated, "speech_keywords"] = [
+                KEYWORD_SEPARATOR.join(speech_keywords[speech_id])
+                for speech_id in self.__speech_summaries_df.index[is_updated]]
+
+    def __summarise_chunk(self, parquet_writer):
+        # Replaces the buffered summary sentences with one summary row per speech, summary rows that were already
+        # computed for the run manifest are used as they are
+        if len(self.__summary_sentences) == 0 and len(self.__summary_rows) == 0:
+            return
+        speech_summaries_dfs = self.__summary_rows
+        if len(self.__summary_sentences) != 0:
+            speech_summaries_dfs.append(generate_summaries(
+                pd.concat(self.__summary_sentences, ignore_index=True)))
+        speech_summaries_df = pd.concat(speech_summaries_dfs)
+        self.__summary_sentences = []
+        self.__summary_rows = []
+        self.__speech_summaries.append(speech_summaries_df)
+        if parquet_writer is not None:
+            parquet_writer.add_summaries(speech_summaries_df)
+            if self.chunk_speeches is not None:
+                parquet_writer.flush()
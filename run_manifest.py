@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from sentiment_aggregates import DEFAULT_TIME_BUCKET, SentimentAggregates
+from speech import KEYWORD_SEPARATOR
+from speech_summary import SUMMARY_COLUMNS
+
+# The columns that make up the content of a speech, the keyword and sentiment columns are left out
+CONTENT_COLUMNS = ["speech_id", "speech_url", "speech_duration", "speech_date_start", "speech_date_end",
+                   "speech_agenda_item_title", "sentence_speaker", "sentence_speaker_status", "sentence_type",
+                   "sentence_text", "sentence_time_start", "sentence_time_end"]
+
+
+def get_speech_content_hash(speech_df):
+    speech_content = speech_df[CONTENT_COLUMNS].to_json(
+        orient="values", force_ascii=False)
+    return hashlib.sha256(speech_content.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    manifest_path = None
+    model_version = None
+
+    def __init__(self, manifest_path, model_version):
+        # The manifest is an append only json lines file with one entry per processed speech and keyword,
+        # a later entry for the same speech and keyword replaces the earlier one
+        self.manifest_path = manifest_path
+        self.model_version = model_version
+        self.__entries = {}
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    # The last line is incomplete if a run was killed while writing it
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.__entries[(entry["speech_id"],
+                                    entry["speech_keyword"])] = entry
+
+    def is_processed(self, speech_id, speech_keyword, content_hash):
+        # True if the speech was already processed with the same content and model.
+        # Entries written before the aggregates, or before the aggregates' keywords, were stored are processed
+        # again, so the aggregates are complete
+        entry = self.__entries.get((speech_id, speech_keyword))
+        return entry is not None and entry["content_hash"] == content_hash and \
+            entry["model_version"] == self.model_version and "aggregate" in entry and \
+            (entry["aggregate"] is None or "speech_keywords" in entry["aggregate"])
+
+    def add_speech(self, speech_df, speech_summary=None, speech_aggregate=None):
+        # Checkpoints a written speech, speech_summary and speech_aggregate (see
+        # sentiment_aggregates.get_speech_aggregate) are None for speeches without a main speaker
+        speech_id = speech_df["speech_id"].iloc[0]
+        speech_keyword = speech_df["speech_keyword"].iloc[0]
+
+        summary = None
+        if speech_summary is not None:
+            summary = json.loads(speech_summary.reset_index().iloc[0].to_json(
+                force_ascii=False))
+
+        entry = {
+            "speech_id": speech_id,
+            "speech_keyword": speech_keyword,
+            "content_hash": get_speech_content_hash(speech_df),
+            "model_version": self.model_version,
+            "summary": summary,
+            "aggregate": speech_aggregate
+        }
+        self.__append_entry(entry)
+
+    def set_speech_keywords(self, speech_id, speech_keyword, speech_keywords):
+        # Records keywords that were found after the speech was checkpointed, speech_keyword is its primary
+        # keyword. The entry is appended again with the new keywords if they differ from the stored ones
+        entry = self.__entries.get((speech_id, speech_keyword))
+        if entry is None or entry["summary"] is None:
+            return
+        joined_keywords = KEYWORD_SEPARATOR.join(speech_keywords)
+        if entry["summary"].get("speech_keywords") == joined_keywords:
+            return
+        updated_entry = dict(entry, summary=dict(entry["summary"], speech_keywords=joined_keywords))
+        if entry.get("aggregate") is not None:
+            updated_entry["aggregate"] = dict(entry["aggregate"], speech_keywords=joined_keywords)
+        self.__append_entry(updated_entry)
+
+    def get_summaries(self):
+        # The summaries of every speech processed so far, in this run and in earlier runs
+        summaries = [entry["summary"] for entry in self.__entries.values()
+                     if entry["summary"] is not None and entry["model_version"] == self.model_version]
+        return pd.DataFrame(summaries, columns=SUMMARY_COLUMNS).set_index("speech_id")
+
+    def get_aggregates(self, time_bucket=DEFAULT_TIME_BUCKET):
+        # The sentiment aggregates of every speech processed so far, in this run and in earlier runs
+        sentiment_aggregates = SentimentAggregates(time_bucket)
+        for entry in self.__entries.values():
+            if entry.get("aggregate") is not None and entry["model_version"] == self.model_version:
+                sentiment_aggregates.add_speech_aggregate(entry["aggregate"])
+        return sentiment_aggregates
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __append_entry(self, entry):
+        with open(self.manifest_path, "a", encoding="utf-8") as manifest_file:
+            manifest_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        self.__entries[(entry["speech_id"], entry["speech_keyword"])] = entry
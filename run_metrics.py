@@ -0,0 +1,200 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Comma separated stage names to profile with cProfile, e.g. PIPELINE_PROFILE_STAGES=parse,infer.
+# Only one stage is profiled at a time, calls of a profiled stage that start while another one is being profiled
+# are timed but not profiled. From Python 3.12 a profile also includes the work of every other thread
+PROFILE_STAGES_VARIABLE = "PIPELINE_PROFILE_STAGES"
+
+# Number of most recent request latencies and batch timings kept for the percentiles, totals count every one
+SAMPLE_WINDOW = 10000
+
+
+class StageTiming:
+    name = None
+    calls = 0
+    seconds = 0
+    max_seconds = 0
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0
+        self.max_seconds = 0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "mean_seconds": self.seconds / self.calls if self.calls != 0 else 0,
+            "max_seconds": self.max_seconds
+        }
+
+
+class RunMetrics:
+    profile_stages = None
+
+    def __init__(self, profile_stages=None):
+        # Stages listed in profile_stages, or in the PIPELINE_PROFILE_STAGES environment variable, are profiled
+        if profile_stages is None:
+            profile_stages = [stage for stage in os.environ.get(
+                PROFILE_STAGES_VARIABLE, "").split(",") if stage != ""]
+        self.profile_stages = list(profile_stages)
+        self.__lock = threading.Lock()
+        self.__start_time = time.perf_counter()
+        self.__stage_timings = {}
+        self.__counters = {}
+        self.__requests = 0
+        self.__network_requests = 0
+        self.__network_latencies = deque(maxlen=SAMPLE_WINDOW)
+        self.__batches = 0
+        self.__batch_sentences = 0
+        self.__batch_seconds = 0
+        self.__batch_timings = deque(maxlen=SAMPLE_WINDOW)
+        self.__extra = {}
+        self.__profilers = {}
+        self.__active_profiler = None
+        self.__unprofiled_calls = {}
+
+    @contextmanager
+    def stage(self, name):
+        profiler = self.__enable_profiler(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                self.__disable_profiler(profiler)
+            with self.__lock:
+                if name not in self.__stage_timings:
+                    self.__stage_timings[name] = StageTiming(name)
+                self.__stage_timings[name].add(seconds)
+
+    def increment(self, counter, amount=1):
+        with self.__lock:
+            self.__counters[counter] = self.__counters.get(
+                counter, 0) + amount
+
+    def record_request(self, url, seconds, source):
+        # source is "network", "cache" or "fixture"
+        with self.__lock:
+            self.__requests += 1
+            if source == "network":
+                self.__network_requests += 1
+                self.__network_latencies.append(seconds)
+        self.increment("http_requests_" + source)
+
+    def record_batch(self, sentences, seconds):
+        with self.__lock:
+            self.__batches += 1
+            self.__batch_sentences += sentences
+            self.__batch_seconds += seconds
+            self.__batch_timings.append((sentences, seconds))
+
+    def set(self, key, value):
+        # Adds any other json serialisable value to the metrics, e.g. cache statistics
+        with self.__lock:
+            self.__extra[key] = value
+
+    def to_dict(self):
+        with self.__lock:
+            wall_seconds = time.perf_counter() - self.__start_time
+            network_latencies = sorted(self.__network_latencies)
+            batch_sizes = sorted(batch_sentences for batch_sentences, _ in self.__batch_timings)
+            batch_seconds = sorted(seconds for _, seconds in self.__batch_timings)
+            sentences = self.__counters.get("sentences", 0)
+            metrics = {
+                "wall_seconds": wall_seconds,
+                "stages": {name: timing.to_dict() for name, timing in self.__stage_timings.items()},
+                "counters": dict(self.__counters),
+                "sentences_per_second": sentences / wall_seconds if wall_seconds != 0 else 0,
+                "http": {
+                    "requests": self.__requests,
+                    "network_requests": self.__network_requests,
+                    "network_p50_seconds": get_percentile(network_latencies, 0.5),
+                    "network_p99_seconds": get_percentile(network_latencies, 0.99)
+                },
+                "inference": {
+                    "batches": self.__batches,
+                    "sentences": self.__batch_sentences,
+                    "seconds": self.__batch_seconds,
+                    "sentences_per_second": self.__batch_sentences / self.__batch_seconds
+                    if self.__batch_seconds != 0 else 0,
+                    "batch_sentences_p50": get_percentile(batch_sizes, 0.5),
+                    "batch_sentences_max": batch_sizes[-1] if len(batch_sizes) != 0 else None,
+                    "batch_p50_seconds": get_percentile(batch_seconds, 0.5),
+                    "batch_p99_seconds": get_percentile(batch_seconds, 0.99)
+                }
+            }
+            if len(self.__unprofiled_calls) != 0:
+                metrics["unprofiled_stage_calls"] = dict(self.__unprofiled_calls)
+            metrics.update(self.__extra)
+        return metrics
+
+    def write_json(self, metrics_path):
+        # Profiles of profiled stages are written next to the metrics file as <stage>.prof
+        with open(metrics_path, "w", encoding="utf-8") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=2, default=str)
+        metrics_dir = os.path.dirname(metrics_path)
+        for name, profiler in self.__profilers.items():
+            profiler.dump_stats(os.path.join(metrics_dir, name + ".prof"))
+
+    def __enable_profiler(self, name):
+        # Returns the stage's enabled profiler, or None if the stage is not profiled or another profile is active.
+        # Python 3.12 allows a single active profiler per process and raises ValueError for a second one
+        if name not in self.profile_stages:
+            return None
+        with self.__lock:
+            if self.__active_profiler is None:
+                if name not in self.__profilers:
+                    self.__profilers[name] = cProfile.Profile()
+                profiler = self.__profilers[name]
+                try:
+                    profiler.enable()
+                    self.__active_profiler = profiler
+                    return profiler
+                except ValueError as error:
+                    reason = str(error)
+            else:
+                reason = "another stage is being profiled"
+            self.__unprofiled_calls[name] = self.__unprofiled_calls.get(name, 0) + 1
+            is_first_unprofiled_call = self.__unprofiled_calls[name] == 1
+        if is_first_unprofiled_call:
+            print("Warning: not profiling some calls of stage " + name + ", " + reason)
+        return None
+
+    def __disable_profiler(self, profiler):
+        with self.__lock:
+            profiler.disable()
+            self.__active_profiler = None
+
+
+def get_percentile(sorted_values, percentile):
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(percentile * len(sorted_values)))]
+
+
+current_metrics = RunMetrics()
+
+
+def get_metrics():
+    return current_metrics
+
+
+def reset_metrics(profile_stages=None):
+    # Starts a new set of metrics, e.g. at the start of a run
+    global current_metrics
+    current_metrics = RunMetrics(profile_stages)
+    return current_metrics
@@ -0,0 +1,293 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from run_metrics import get_percentile
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# A micro batch is run once it holds max_batch_size sentences or its first request has waited max_wait_ms
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 10
+
+# Number of recent requests and batches kept for the latency and batch fill statistics
+STATS_WINDOW = 10000
+
+# Seconds a client waits for the service to answer
+DEFAULT_CLIENT_TIMEOUT = 300
+
+
+class ScoringRequest:
+    sentences = None
+    sentiment_scores = None
+    sentiment_weights = None
+    error = None
+
+    def __init__(self, sentences, chunk_count):
+        self.sentences = sentences
+        self.sentiment_scores = [None] * len(sentences)
+        self.sentiment_weights = [None] * len(sentences)
+        self.error = None
+        self.received_time = time.perf_counter()
+        self.done = threading.Event()
+        self.__remaining_chunks = chunk_count
+        self.__lock = threading.Lock()
+
+    def complete_chunk(self):
+        with self.__lock:
+            self.__remaining_chunks -= 1
+            if self.__remaining_chunks == 0:
+                self.done.set()
+
+
+class MicroBatcher:
+    sentiment_model = None
+    max_batch_size = DEFAULT_MAX_BATCH_SIZE
+    max_wait_ms = DEFAULT_MAX_WAIT_MS
+
+    def __init__(self, sentiment_model, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        # Sentences of concurrent requests are merged into batches of at most max_batch_size sentences
+        self.sentiment_model = sentiment_model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        # Chunks are (request, offset, sentences) with at most max_batch_size sentences
+        self.__chunks = queue.Queue()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__stats_lock = threading.Lock()
+        self.__latencies = deque(maxlen=STATS_WINDOW)
+        self.__batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.__batch_request_counts = deque(maxlen=STATS_WINDOW)
+        self.__requests = 0
+        self.__batches = 0
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def predict(self, sentences):
+        # Blocks until every sentence has been scored, returns (scores, weights) like predict_sentiment
+        if len(sentences) == 0:
+            return [], []
+        chunk_offsets = range(0, len(sentences), self.max_batch_size)
+        scoring_request = ScoringRequest(sentences, len(chunk_offsets))
+        for offset in chunk_offsets:
+            self.__chunks.put((scoring_request, offset,
+                              sentences[offset:offset + self.max_batch_size]))
+        scoring_request.done.wait()
+
+        with self.__stats_lock:
+            self.__requests += 1
+            self.__latencies.append(
+                time.perf_counter() - scoring_request.received_time)
+        if scoring_request.error is not None:
+            raise scoring_request.error
+        return scoring_request.sentiment_scores, scoring_request.sentiment_weights
+
+    def get_stats(self):
+        with self.__stats_lock:
+            latencies = sorted(self.__latencies)
+            batch_sizes = list(self.__batch_sizes)
+            batch_request_counts = list(self.__batch_request_counts)
+            requests_total = self.__requests
+            batches_total = self.__batches
+        mean_batch_size = sum(batch_sizes) / \
+            len(batch_sizes) if len(batch_sizes) != 0 else 0
+        return {
+            "requests": requests_total,
+            "batches": batches_total,
+            "latency_p50_ms": None if len(latencies) == 0 else get_percentile(latencies, 0.5) * 1000,
+            "latency_p99_ms": None if len(latencies) == 0 else get_percentile(latencies, 0.99) * 1000,
+            "mean_batch_size": mean_batch_size,
+            "mean_batch_fill": mean_batch_size / self.max_batch_size,
+            "mean_requests_per_batch": sum(batch_request_counts) / len(batch_request_counts)
+            if len(batch_request_counts) != 0 else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms
+        }
+
+    def __run(self):
+        carried_chunk = None
+        while not self.__stop.is_set():
+            if carried_chunk is not None:
+                first_chunk, carried_chunk = carried_chunk, None
+            else:
+                try:
+                    first_chunk = self.__chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+            # Wait at most max_wait_ms after the first chunk for more chunks to fill the batch
+            chunks = [first_chunk]
+            batch_size = len(first_chunk[2])
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while batch_size < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    chunk = self.__chunks.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if batch_size + len(chunk[2]) > self.max_batch_size:
+                    carried_chunk = chunk
+                    break
+                chunks.append(chunk)
+                batch_size += len(chunk[2])
+
+            self.__run_batch(chunks)
+
+    def __run_batch(self, chunks):
+        batch = []
+        for _, _, chunk_sentences in chunks:
+            batch += chunk_sentences
+
+        try:
+            result = self.sentiment_model.predict_sentiment(batch, True)
+        except Exception as error:
+            for scoring_request, _, _ in chunks:
+                scoring_request.error = error
+                scoring_request.complete_chunk()
+            return
+
+        position = 0
+        for scoring_request, offset, chunk_sentences in chunks:
+            chunk_end = position + len(chunk_sentences)
+            scoring_request.sentiment_scores[offset:offset + len(chunk_sentences)] = \
+                result[0][position:chunk_end]
+            scoring_request.sentiment_weights[offset:offset + len(chunk_sentences)] = \
+                result[1][position:chunk_end]
+            position = chunk_end
+            scoring_request.complete_chunk()
+
+        with self.__stats_lock:
+            self.__batches += 1
+            self.__batch_sizes.append(len(batch))
+            self.__batch_request_counts.append(
+                len({id(scoring_request) for scoring_request, _, _ in chunks}))
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    # POST /predict {"sentences": [...]} returns {"scores": [...], "weights": [...]}, GET /stats the statistics
+    micro_batcher = None
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self.__send_json(404, {"error": "Unknown path " + self.path})
+            return
+        try:
+            request_body = json.loads(self.rfile.read(
+                int(self.headers.get("Content-Length", 0))))
+            sentences = request_body["sentences"]
+            # A string would otherwise be scored character by character
+            if not isinstance(sentences, list) or not all(isinstance(sentence, str) for sentence in sentences):
+                raise TypeError("sentences is not a list of strings")
+        except (ValueError, KeyError, TypeError):
+            self.__send_json(
+                400, {"error": "Expected a json body with a sentences list of strings"})
+            return
+        try:
+            sentiment_scores, sentiment_weights = self.micro_batcher.predict(
+                sentences)
+        except Exception as error:
+            self.__send_json(500, {"error": str(error)})
+            return
+        self.__send_json(
+            200, {"scores": sentiment_scores, "weights": sentiment_weights})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.__send_json(200, self.micro_batcher.get_stats())
+        elif self.path == "/health":
+            self.__send_json(200, {"status": "ok"})
+        else:
+            self.__send_json(404, {"error": "Unknown path " + self.path})
+
+    def log_message(self, format, *args):
+        # Requests are not logged, there is one per scored speech batch
+        pass
+
+    def __send_json(self, status, body):
+        # default=float converts numpy or torch scalars in the model weights
+        response_body = json.dumps(body, default=float).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+
+class ScoringService:
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    micro_batcher = None
+
+    def __init__(self, sentiment_model, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        # port 0 picks a free port, the chosen port is available as self.port after start
+        self.micro_batcher = MicroBatcher(
+            sentiment_model, max_batch_size, max_wait_ms)
+        handler = type("BoundScoringRequestHandler", (ScoringRequestHandler,),
+                       {"micro_batcher": self.micro_batcher})
+        self.__server = ThreadingHTTPServer((host, port), handler)
+        self.host = host
+        self.port = self.__server.server_address[1]
+        self.__thread = None
+
+    def get_url(self):
+        return "http://" + self.host + ":" + str(self.port)
+
+    def start(self):
+        # Serves in a background thread
+        self.micro_batcher.start()
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def serve_forever(self):
+        self.micro_batcher.start()
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.micro_batcher.stop()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.micro_batcher.stop()
+
+
+class ScoringServiceClient:
+    url = None
+    timeout = DEFAULT_CLIENT_TIMEOUT
+
+    def __init__(self, url="http://" + DEFAULT_HOST + ":" + str(DEFAULT_PORT), timeout=DEFAULT_CLIENT_TIMEOUT):
+        # Has the same predict_sentiment interface as SentimentModel, so it can be passed wherever a model is used
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def predict_sentiment(self, texts, output_probabilities=False):
+        response = self.session.post(
+            self.url + "/predict", json={"sentences": list(texts)}, timeout=self.timeout)
+        response_body = response.json()
+        if not response.ok:
+            raise ValueError("Scoring service error: " +
+                             response_body.get("error", str(response.status_code)))
+        if output_probabilities:
+            return response_body["scores"], response_body["weights"]
+        return response_body["scores"]
+
+    def get_stats(self):
+        return self.session.get(self.url + "/stats", timeout=self.timeout).json()
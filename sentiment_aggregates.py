@@ -0,0 +1,180 @@
+import json
+from datetime import date
+
+import pandas as pd
+
+from speech import KEYWORD_SEPARATOR
+from speech_summary import SENTIMENT_SCORES, get_summary_sentence_mask
+
+# A speech is counted once under the faction, party, keywords, speaker and time bucket of its main speaker.
+# speech_keywords holds every keyword that found the speech, see SentimentAggregates.get_grouped
+AGGREGATE_KEY_COLUMNS = ["main_speaker_faction", "main_speaker_party", "speech_keywords", "main_speaker",
+                         "time_bucket"]
+
+# Columns the aggregates can be grouped by, speech_keyword counts a speech under each of its keywords
+GROUP_COLUMNS = AGGREGATE_KEY_COLUMNS + ["speech_keyword"]
+
+# Durations are summed as integer milliseconds, so partial aggregates combine exactly in any order
+AGGREGATE_VALUE_COLUMNS = ["speeches"] + ["duration_ms_" + sentiment_score for sentiment_score in SENTIMENT_SCORES] + \
+    ["sentences_" + sentiment_score for sentiment_score in SENTIMENT_SCORES]
+
+TIME_BUCKETS = ["day", "week", "month", "year"]
+DEFAULT_TIME_BUCKET = "month"
+
+
+def get_time_bucket(speech_date_start, time_bucket=DEFAULT_TIME_BUCKET):
+    # speech_date_start is an iso string like 2022-11-22T10:51:00+01:00, the bucket is taken from the local date
+    speech_date = date.fromisoformat(speech_date_start[:10])
+    if time_bucket == "day":
+        return speech_date.isoformat()
+    if time_bucket == "week":
+        iso_year, iso_week, _ = speech_date.isocalendar()
+        return str(iso_year) + "-W" + str(iso_week).zfill(2)
+    if time_bucket == "month":
+        return speech_date.isoformat()[:7]
+    if time_bucket == "year":
+        return str(speech_date.year)
+    raise ValueError("Unknown time bucket " + str(time_bucket))
+
+
+def get_speech_aggregate(speech_df):
+    # The values one scored speech adds to the aggregates, as a json serialisable dict with the faction, party
+    # and speaker, the keywords, the speech start date and the values in AGGREGATE_VALUE_COLUMNS order.
+    # None for speeches without a main speaker
+    main_speaker_mask = get_summary_sentence_mask(speech_df)
+    if not main_speaker_mask.any():
+        return None
+
+    # The speaker and speech metadata are taken from the first main speaker sentence, as in the summary
+    first_sentence = speech_df.iloc[main_speaker_mask.argmax()]
+    key = [first_sentence["sentence_speaker_faction"], first_sentence["sentence_speaker_party"],
+           first_sentence["sentence_speaker"]]
+    # Csvs written before speeches were deduplicated across keywords only have speech_keyword
+    speech_keywords = first_sentence["speech_keywords"] if "speech_keywords" in speech_df else \
+        first_sentence["speech_keyword"]
+
+    sentiment_scores = speech_df["sentence_sentiment_score"].to_numpy()[main_speaker_mask]
+    duration_ms = (speech_df["sentence_duration"].to_numpy()[main_speaker_mask] * 1000).round().astype(int)
+    speech_values = [1]
+    speech_values += [int(duration_ms[sentiment_scores == sentiment_score].sum())
+                      for sentiment_score in SENTIMENT_SCORES]
+    speech_values += [int((sentiment_scores == sentiment_score).sum())
+                      for sentiment_score in SENTIMENT_SCORES]
+
+    return {"key": [None if pd.isna(key_value) else key_value for key_value in key],
+            "speech_keywords": None if pd.isna(speech_keywords) else speech_keywords,
+            "speech_date_start": first_sentence["speech_date_start"],
+            "values": speech_values}
+
+
+class SentimentAggregates:
+    time_bucket = DEFAULT_TIME_BUCKET
+
+    def __init__(self, time_bucket=DEFAULT_TIME_BUCKET):
+        # Maps a key tuple in AGGREGATE_KEY_COLUMNS order to a list of values in AGGREGATE_VALUE_COLUMNS order
+        if time_bucket not in TIME_BUCKETS:
+            raise ValueError("Unknown time bucket " + str(time_bucket))
+        self.time_bucket = time_bucket
+        self.__totals = {}
+
+    def add_speech(self, speech_df):
+        # Adds the main speaker sentences of one scored speech, the same sentences the summary is built from.
+        # The cost depends on the size of the speech, not on the number of speeches already added.
+        # Returns False for speeches without a main speaker, which are not counted
+        speech_aggregate = get_speech_aggregate(speech_df)
+        if speech_aggregate is None:
+            return False
+        self.add_speech_aggregate(speech_aggregate)
+        return True
+
+    def add_speech_aggregate(self, speech_aggregate):
+        # Adds a speech's values from get_speech_aggregate, e.g. as stored in the run manifest
+        faction, party, speaker = speech_aggregate["key"]
+        key = (faction, party, speech_aggregate["speech_keywords"], speaker,
+               get_time_bucket(speech_aggregate["speech_date_start"], self.time_bucket))
+        self.__add_values(self.__get_key(key), speech_aggregate["values"])
+
+    def merge(self, other):
+        # Adds the totals of another SentimentAggregates, e.g. from an earlier run or another worker
+        if other.time_bucket != self.time_bucket:
+            raise ValueError("Cannot merge " + other.time_bucket + " aggregates into " + self.time_bucket +
+                             " aggregates")
+        for key, values in other.get_totals().items():
+            self.__add_values(key, values)
+        return self
+
+    def get_totals(self):
+        return self.__totals
+
+    def is_empty(self):
+        return len(self.__totals) == 0
+
+    def to_df(self):
+        # One row per key, with the durations converted back to seconds
+        aggregates_df = pd.DataFrame([list(key) + values for key, values in self.__totals.items()],
+                                     columns=AGGREGATE_KEY_COLUMNS + AGGREGATE_VALUE_COLUMNS)
+        for key_column in AGGREGATE_KEY_COLUMNS:
+            aggregates_df[key_column] = aggregates_df[key_column].astype(object)
+        for sentiment_score in SENTIMENT_SCORES:
+            aggregates_df["duration_" + sentiment_score] = \
+                aggregates_df.pop("duration_ms_" + sentiment_score) / 1000
+        return aggregates_df
+
+    def get_grouped(self, group_columns):
+        # Rolls the aggregates up to any subset of GROUP_COLUMNS, e.g. ["main_speaker_faction"]. Grouped by
+        # speech_keyword a speech found by several keywords is counted under each of them, so those totals add up
+        # to more than the totals without speech_keyword
+        for group_column in group_columns:
+            if group_column not in GROUP_COLUMNS:
+                raise ValueError("Cannot group by " + group_column)
+        aggregates_df = self.to_df()
+        if "speech_keyword" in group_columns:
+            aggregates_df = aggregates_df.assign(
+                speech_keyword=aggregates_df["speech_keywords"].str.split(KEYWORD_SEPARATOR)).explode(
+                "speech_keyword")
+        aggregates_df = aggregates_df.drop(
+            columns=[key_column for key_column in GROUP_COLUMNS
+                     if key_column not in group_columns and key_column in aggregates_df])
+        grouped_df = aggregates_df.groupby(group_columns, dropna=False).sum()
+
+        grouped_df["total_duration"] = sum(grouped_df["duration_" + sentiment_score]
+                                           for sentiment_score in SENTIMENT_SCORES)
+        grouped_df["total_sentences"] = sum(grouped_df["sentences_" + sentiment_score]
+                                            for sentiment_score in SENTIMENT_SCORES)
+        for sentiment_score in SENTIMENT_SCORES:
+            grouped_df["percentage_" + sentiment_score] = \
+                grouped_df["duration_" + sentiment_score] / grouped_df["total_duration"]
+        return grouped_df
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as aggregates_file:
+            json.dump({"time_bucket": self.time_bucket,
+                       "columns": AGGREGATE_KEY_COLUMNS + AGGREGATE_VALUE_COLUMNS,
+                       "rows": [list(key) + values for key, values in self.__totals.items()]},
+                      aggregates_file, ensure_ascii=False)
+
+    @staticmethod
+    def load_json(path):
+        with open(path, encoding="utf-8") as aggregates_file:
+            aggregates_json = json.load(aggregates_file)
+        if aggregates_json["columns"] != AGGREGATE_KEY_COLUMNS + AGGREGATE_VALUE_COLUMNS:
+            raise ValueError("Aggregates in " + path + " have different columns")
+
+        sentiment_aggregates = SentimentAggregates(aggregates_json["time_bucket"])
+        key_length = len(AGGREGATE_KEY_COLUMNS)
+        for row in aggregates_json["rows"]:
+            sentiment_aggregates.__add_values(tuple(row[:key_length]), row[key_length:])
+        return sentiment_aggregates
+
+    @staticmethod
+    def __get_key(key):
+        # Missing values read from csv or parquet are NaN, they are stored as None so equal keys match
+        return tuple(None if pd.isna(key_value) else key_value for key_value in key)
+
+    def __add_values(self, key, values):
+        totals = self.__totals.get(key)
+        if totals is None:
+            self.__totals[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                totals[i] += value
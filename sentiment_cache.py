@@ -0,0 +1,129 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_CACHE_PATH = "./cache/sentiment_cache.sqlite"
+
+# Number of results kept in memory in front of the sqlite database
+DEFAULT_MEMORY_SIZE = 100000
+
+
+def normalise_sentence(sentence):
+    # Sentences from the api contain line breaks and indentation in the middle of the text
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", sentence)).strip()
+
+
+class SentimentCache:
+    cache_path = None
+    model_id = None
+    memory_size = None
+    hits = 0
+    misses = 0
+
+    def __init__(self, model_id, cache_path=DEFAULT_CACHE_PATH, memory_size=DEFAULT_MEMORY_SIZE):
+        self.model_id = model_id
+        self.cache_path = cache_path
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self.__memory = OrderedDict()
+
+        cache_directory = os.path.dirname(cache_path)
+        if cache_directory != "":
+            os.makedirs(cache_directory, exist_ok=True)
+
+        # The cache is used from the pipeline's inference thread, so the connection is shared between threads
+        # and every use of it holds the lock
+        self.__lock = threading.RLock()
+        self.__connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.__connection.execute(
+            "CREATE TABLE IF NOT EXISTS sentence_sentiment ("
+            "sentence_key TEXT PRIMARY KEY, model_id TEXT NOT NULL, sentiment_score TEXT NOT NULL, "
+            "positive_weight REAL NOT NULL, negative_weight REAL NOT NULL, neutral_weight REAL NOT NULL)")
+        self.__connection.commit()
+
+    def get_key(self, sentence):
+        # The key is content addressed, the same sentence scored by a different model gets a different key
+        key_source = self.model_id + "\n" + normalise_sentence(sentence)
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def get_many(self, sentences):
+        # Returns a dict of sentence -> (score, positive, negative, neutral) for the sentences that are cached
+        with self.__lock:
+            results = {}
+            keys_to_load = {}
+            for sentence in sentences:
+                key = self.get_key(sentence)
+                if key in self.__memory:
+                    self.__memory.move_to_end(key)
+                    results[sentence] = self.__memory[key]
+                else:
+                    keys_to_load.setdefault(key, []).append(sentence)
+
+            key_list = list(keys_to_load)
+            # sqlite limits the number of parameters in a query, so load in chunks
+            for chunk_start in range(0, len(key_list), 500):
+                chunk = key_list[chunk_start:chunk_start + 500]
+                rows = self.__connection.execute(
+                    "SELECT sentence_key, sentiment_score, positive_weight, negative_weight, neutral_weight "
+                    "FROM sentence_sentiment WHERE sentence_key IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+                for row in rows:
+                    result = tuple(row[1:])
+                    self.__remember(row[0], result)
+                    for sentence in keys_to_load[row[0]]:
+                        results[sentence] = result
+
+            self.hits += len(results)
+            self.misses += len(sentences) - len(results)
+            return results
+
+    def put_many(self, sentence_results):
+        # sentence_results is a dict of sentence -> (score, positive, negative, neutral)
+        with self.__lock:
+            rows = []
+            for sentence, result in sentence_results.items():
+                key = self.get_key(sentence)
+                self.__remember(key, result)
+                rows.append((key, self.model_id) + tuple(result))
+
+            self.__connection.executemany(
+                "INSERT OR REPLACE INTO sentence_sentiment VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.__connection.commit()
+
+    def clear(self):
+        # Removes every result of this model, so the next run rescores all sentences
+        with self.__lock:
+            self.__memory.clear()
+            self.__connection.execute(
+                "DELETE FROM sentence_sentiment WHERE model_id = ?", (self.model_id,))
+            self.__connection.commit()
+
+    def evict_other_models(self):
+        # Removes results that were scored by any model other than this one, e.g. after a model upgrade
+        with self.__lock:
+            self.__connection.execute(
+                "DELETE FROM sentence_sentiment WHERE model_id != ?", (self.model_id,))
+            self.__connection.commit()
+
+    def get_stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total != 0 else 0
+        print("Sentiment cache: " + str(self.hits) + " hits, " + str(self.misses) +
+              " misses (" + "{:.1%}".format(hit_rate) + " hit rate)")
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def __remember(self, key, result):
+        self.__memory[key] = result
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.memory_size:
+            self.__memory.popitem(last=False)
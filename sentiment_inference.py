@@ -0,0 +1,89 @@
+import time
+
+import pandas as pd
+
+from run_metrics import get_metrics
+
+# Number of sentences sent to the model in one forward pass
+DEFAULT_BATCH_SIZE = 32
+
+SENTIMENT_RESULT_COLUMNS = ["sentence_sentiment_score", "sentence_sentiment_positive_weight",
+                            "sentence_sentiment_negative_weight", "sentence_sentiment_neutral_weight"]
+
+
+def get_length_bucketed_batches(sentences, batch_size=DEFAULT_BATCH_SIZE):
+    # Sorting by length means the sentences in a batch have a similar token count, so less padding is needed
+    sorted_sentences = sorted(sentences, key=len)
+    return [sorted_sentences[i:i + batch_size] for i in range(0, len(sorted_sentences), batch_size)]
+
+
+def predict_sentences(sentiment_model, sentences, batch_size=DEFAULT_BATCH_SIZE, sentiment_cache=None):
+    # Returns a dataframe indexed by sentence text with one row per unique sentence
+    unique_sentences = list(dict.fromkeys(sentences))
+
+    # Results are (score, positive weight, negative weight, neutral weight) tuples
+    sentence_results = {}
+    if sentiment_cache is not None:
+        sentence_results = sentiment_cache.get_many(unique_sentences)
+
+    uncached_sentences = [
+        sentence for sentence in unique_sentences if sentence not in sentence_results]
+
+    batches = get_length_bucketed_batches(uncached_sentences, batch_size)
+    metrics = get_metrics()
+    if hasattr(sentiment_model, "predict_batches"):
+        # A model pool scores all batches in parallel, see inference_pool.SentimentModelPool.
+        # The batches overlap, so they are recorded as one batch
+        batches_start = time.perf_counter()
+        batch_results = sentiment_model.predict_batches(batches)
+        if len(batches) != 0:
+            metrics.record_batch(len(uncached_sentences),
+                                 time.perf_counter() - batches_start)
+    else:
+        batch_results = []
+        for batch in batches:
+            batch_start = time.perf_counter()
+            batch_results.append(sentiment_model.predict_sentiment(batch, True))
+            metrics.record_batch(len(batch), time.perf_counter() - batch_start)
+
+    predicted_results = {}
+    for batch, result in zip(batches, batch_results):
+        for sentence, sentiment_score, weights in zip(batch, result[0], result[1]):
+            # Positive, negative and neutral are the 0th, 1st and 2nd elements, the weighting is always the 1st
+            predicted_results[sentence] = (
+                sentiment_score, weights[0][1], weights[1][1], weights[2][1])
+
+    if sentiment_cache is not None and len(predicted_results) != 0:
+        sentiment_cache.put_many(predicted_results)
+    sentence_results.update(predicted_results)
+    # Cache hits are part of the unique sentences, only the uncached ones were scored by the model
+    print("Scored " + str(len(uncached_sentences)) + " sentences with the model, " +
+          str(len(unique_sentences)) + " unique sentences out of " + str(len(sentences)) + " sentences")
+
+    return pd.DataFrame([sentence_results[sentence] for sentence in unique_sentences],
+                        columns=SENTIMENT_RESULT_COLUMNS,
+                        index=pd.Index(unique_sentences, dtype=object, name="sentence_text"))
+
+
+def analyse_speeches_sentiment(speeches, sentiment_model, batch_size=DEFAULT_BATCH_SIZE, sentiment_cache=None,
+                               summary_only=False):
+    # Scores the sentences of all speeches together, so each distinct sentence is only sent to the model once.
+    # With summary_only the filter of the summary is applied before scoring, so comments, interjections and
+    # other speakers are not sent to the model, see speech_summary.get_summary_sentence_mask
+    all_sentences = []
+    sentence_total = 0
+    for speech in speeches:
+        all_sentences += speech.get_sentences_to_score(summary_only)
+        sentence_total += len(speech.get_speech_df())
+
+    sentence_results = predict_sentences(
+        sentiment_model, all_sentences, batch_size, sentiment_cache)
+
+    if summary_only:
+        get_metrics().increment("sentences_unscored",
+                                sentence_total - len(all_sentences))
+
+    for speech in speeches:
+        speech.set_sentiment_results(sentence_results, summary_only)
+
+    return sentence_results
@@ -1,6 +1,11 @@
-import requests
 import json
 import pandas as pd
+from api_client import get_default_client
+from speech_summary import generate_speech_summary, get_summary_sentence_mask
+from sentiment_inference import DEFAULT_BATCH_SIZE, SENTIMENT_RESULT_COLUMNS, predict_sentences
+
+# Separates the keywords in speech_keywords, keywords can contain spaces
+KEYWORD_SEPARATOR = "|"
 
 
 class Speech:
@@ -8,232 +13,183 @@ class Speech:
     sentiment_model = None
     speech_df = None
 
-    def __init__(self, url=None, speech_raw_json=None):
+    def __init__(self, url=None, speech_raw_json=None, api_client=None):
         if url is None and speech_raw_json is None:
             raise ValueError("Must provide either url or speech_raw_json")
         if url is not None and speech_raw_json is not None:
             raise ValueError(
                 "Must provide either url or speech_raw_json, not both")
         if url is not None:
-            self.__init_from_url(url)
+            self.__init_from_url(url, api_client)
         else:
             self.__init_from_speech_raw_json(speech_raw_json)
 
         self.speech_df = self.__parse_speech()
 
-    def __init_from_url(self, url):
-        self.speech_raw_json = requests.get(url).json()
+    def __init_from_url(self, url, api_client=None):
+        if api_client is None:
+            api_client = get_default_client()
+        self.speech_raw_json = api_client.get_json(url)
 
     def __init_from_speech_raw_json(self, speech_raw_json):
         self.speech_raw_json = speech_raw_json
 
     def __parse_speech(self):
-        speech_df = pd.DataFrame()
+        speech_data = self.speech_raw_json["data"]
+        speech_attributes = speech_data["attributes"]
+
+        # Speech level metadata is the same for every sentence, so read it once
+        # The api url of the speech
+        speech_url = speech_data["links"]["self"]
+
+        # The total speech duration, including comments and other non speech sentences
+        speech_duration = speech_attributes["duration"]
+
+        # The start/end date/time of the speech. These are strings
+        speech_date_start = speech_attributes["dateStart"]
+        speech_date_end = speech_attributes["dateEnd"]
 
-        raw_speech_excerpts = self.speech_raw_json[
-            "data"]["attributes"]["textContents"][0]["textBody"]
+        # Speech agenda item title
+        speech_agenda_item_title = speech_data["relationships"]["agendaItem"]["data"]["attributes"]["officialTitle"]
+
+        speaker_index = self.__build_speaker_index(
+            speech_data["relationships"]["people"]["data"])
+
+        speech_ids = []
+        sentence_speakers = []
+        sentence_speaker_statuses = []
+        sentence_speaker_parties = []
+        sentence_speaker_factions = []
+        sentence_types = []
+        sentence_texts = []
+        sentence_time_starts = []
+        sentence_time_ends = []
+
+        raw_speech_excerpts = speech_attributes["textContents"][0]["textBody"]
 
         for raw_speech_excerpt in raw_speech_excerpts:
-            speech_excerpt_sentences = raw_speech_excerpt["sentences"]
-            for speech_excerpt_sentence in speech_excerpt_sentences:
-                # The id of the speech in the database
-                speech_id = raw_speech_excerpt["speech_id"]
-
-                # The api url of the speech
-                speech_url = self.speech_raw_json["data"]["links"]["self"]
-
-                # The total speech duration, including comments and other non speech sentences
-                speech_duration = self.speech_raw_json["data"]["attributes"]["duration"]
-
-                # The start date/time of the speech. This is a string
-                speech_date_start = self.speech_raw_json["data"]["attributes"]["dateStart"]
-
-                # The end date/time of the speech. This is a string
-                speech_date_end = self.speech_raw_json["data"]["attributes"]["dateEnd"]
-
-                # Speech agenda item title
-                speech_agenda_item_title = self.speech_raw_json["data"][
-                    "relationships"]["agendaItem"]["data"]["attributes"]["officialTitle"]
-
-                # The speaker of the sentence note: this can be null
-                sentence_speaker = raw_speech_excerpt["speaker"]
-
-                # The status of the speaker, e.g. "president" or "main-speaker", note: this can be null
-                sentence_speaker_status = raw_speech_excerpt["speakerstatus"]
-
-                # The type of the sentence, e.g. "speech" or "comment"
-                sentence_type = raw_speech_excerpt["type"]
-
-                # The text of the sentence
-                sentence_text = speech_excerpt_sentence["text"]
-
-                # sentence start time in seconds
-                if "timeStart" not in speech_excerpt_sentence:
-                    sentence_time_start = 0
-                else:
-                    sentence_time_start = float(
-                        speech_excerpt_sentence["timeStart"])
-
-                # sentence end time in seconds
-                if "timeEnd" not in speech_excerpt_sentence:
-                    sentence_time_end = 0
-                else:
-                    sentence_time_end = float(
-                        speech_excerpt_sentence["timeEnd"])
-
-                # the sentence duration in seconds (end - start)
-                sentence_duration = sentence_time_end - sentence_time_start
-
-                for person in self.speech_raw_json["data"]["relationships"]["people"]["data"]:
-                    if sentence_speaker == None:
-                        sentence_speaker_party = None
-                        sentence_speaker_faction = None
-                        break
-                    elif person["attributes"]["label"] == sentence_speaker:
-                        sentence_speaker_party = person["attributes"]["party"]["label"]
-                        sentence_speaker_faction = person["attributes"]["faction"]["label"]
-                        break
-                    elif sentence_speaker in person["attributes"]["labelAlternative"]:
-                        sentence_speaker_party = person["attributes"]["party"]["label"]
-                        sentence_speaker_faction = person["attributes"]["faction"]["label"]
-                        break
-                    else:
-                        sentence_speaker_party = None
-                        sentence_speaker_faction = None
-
-                # These are the sentiment scores initialised as None
-                sentence_sentiment_score = None
-                sentence_sentiment_positive_weight = None
-                sentence_sentiment_negative_weight = None
-                sentence_sentiment_neutral_weight = None
-
-                # This is the dictionary that will be appended to the dataframe
-                speech_excerpt_sentence_dict = {
-                    "speech_id": speech_id,
-                    "speech_url": speech_url,
-                    "speech_keyword": None,
-                    "speech_duration": speech_duration,
-                    "speech_date_start": speech_date_start,
-                    "speech_date_end": speech_date_end,
-                    "speech_agenda_item_title": speech_agenda_item_title,
-                    "sentence_speaker": sentence_speaker,
-                    "sentence_speaker_status": sentence_speaker_status,
-                    "sentence_speaker_party": sentence_speaker_party,
-                    "sentence_speaker_faction": sentence_speaker_faction,
-                    "sentence_type": sentence_type,
-                    "sentence_text": sentence_text,
-                    "sentence_time_start": sentence_time_start,
-                    "sentence_time_end": sentence_time_end,
-                    "sentence_duration": sentence_duration,
-                    "sentence_sentiment_score": sentence_sentiment_score,
-                    "sentence_sentiment_positive_weight": sentence_sentiment_positive_weight,
-                    "sentence_sentiment_negative_weight": sentence_sentiment_negative_weight,
-                    "sentence_sentiment_neutral_weight": sentence_sentiment_neutral_weight
-                }
-
-                sentence_df = pd.DataFrame(
-                    speech_excerpt_sentence_dict, index=[0])
-
-                speech_df = pd.concat([speech_df, sentence_df],
-                                      ignore_index=True)
+            # The speaker of the sentence note: this can be null
+            sentence_speaker = raw_speech_excerpt["speaker"]
 
-        return speech_df
+            # The party and faction are resolved once per excerpt, not once per sentence
+            sentence_speaker_party, sentence_speaker_faction = self.__resolve_speaker(
+                speaker_index, sentence_speaker)
 
-    def analyse_sentiment(self, sentiment_model):
-        sentences_text_numpy_array = self.speech_df["sentence_text"].to_numpy()
-        sentences_text_array = sentences_text_numpy_array.tolist()
+            speech_excerpt_sentences = raw_speech_excerpt["sentences"]
+            sentence_count = len(speech_excerpt_sentences)
+
+            # The id of the speech in the database
+            speech_ids += [raw_speech_excerpt["speech_id"]] * sentence_count
+            sentence_speakers += [sentence_speaker] * sentence_count
+            # The status of the speaker, e.g. "president" or "main-speaker", note: this can be null
+            sentence_speaker_statuses += [raw_speech_excerpt["speakerstatus"]] * sentence_count
+            sentence_speaker_parties += [sentence_speaker_party] * sentence_count
+            sentence_speaker_factions += [sentence_speaker_faction] * sentence_count
+            # The type of the sentence, e.g. "speech" or "comment"
+            sentence_types += [raw_speech_excerpt["type"]] * sentence_count
 
-        result = sentiment_model.predict_sentiment(
-            sentences_text_array, True)
+            for speech_excerpt_sentence in speech_excerpt_sentences:
+                sentence_texts.append(speech_excerpt_sentence["text"])
+                # sentence start/end time in seconds, 0 if missing
+                sentence_time_starts.append(
+                    float(speech_excerpt_sentence.get("timeStart", 0)))
+                sentence_time_ends.append(
+                    float(speech_excerpt_sentence.get("timeEnd", 0)))
+
+        sentence_total = len(sentence_texts)
+
+        # the sentence duration in seconds (end - start)
+        sentence_durations = [time_end - time_start for time_start, time_end
+                              in zip(sentence_time_starts, sentence_time_ends)]
+
+        # The speaker columns can contain None, they are kept as object columns so None is not turned into NaN
+        speech_df = pd.DataFrame({
+            "speech_id": speech_ids,
+            "speech_url": [speech_url] * sentence_total,
+            "speech_keyword": [None] * sentence_total,
+            # Every keyword whose search found the speech, joined with KEYWORD_SEPARATOR
+            "speech_keywords": [None] * sentence_total,
+            "speech_duration": [speech_duration] * sentence_total,
+            "speech_date_start": [speech_date_start] * sentence_total,
+            "speech_date_end": [speech_date_end] * sentence_total,
+            "speech_agenda_item_title": [speech_agenda_item_title] * sentence_total,
+            "sentence_speaker": pd.Series(sentence_speakers, dtype=object),
+            "sentence_speaker_status": pd.Series(sentence_speaker_statuses, dtype=object),
+            "sentence_speaker_party": pd.Series(sentence_speaker_parties, dtype=object),
+            "sentence_speaker_faction": pd.Series(sentence_speaker_factions, dtype=object),
+            "sentence_type": sentence_types,
+            "sentence_text": sentence_texts,
+            "sentence_time_start": sentence_time_starts,
+            "sentence_time_end": sentence_time_ends,
+            "sentence_duration": sentence_durations,
+            # These are the sentiment scores initialised as None
+            "sentence_sentiment_score": [None] * sentence_total,
+            "sentence_sentiment_positive_weight": [None] * sentence_total,
+            "sentence_sentiment_negative_weight": [None] * sentence_total,
+            "sentence_sentiment_neutral_weight": [None] * sentence_total,
+            # Whether the sentence has been scored, in summary only mode only the main speaker's speech is scored
+            "sentence_scored": [False] * sentence_total
+        })
 
-        sentiment_scores = result[0]
-        sentiment_weights = result[1]
+        return speech_df
 
-        for i, sentiment_score in enumerate(sentiment_scores):
-            self.speech_df.at[i, "sentence_sentiment_score"] = sentiment_score
-            # Positive is the 0th element, the weighting is always the 1st
-            self.speech_df.at[i,
-                              "sentence_sentiment_positive_weight"] = sentiment_weights[i][0][1]
-            # Negative is the 1st element, the weighting is always the 1st
-            self.speech_df.at[i,
-                              "sentence_sentiment_negative_weight"] = sentiment_weights[i][1][1]
-            # Neutral is the 2nd element, the weighting is always the 1st
-            self.speech_df.at[i,
-                              "sentence_sentiment_neutral_weight"] = sentiment_weights[i][2][1]
+    @staticmethod
+    def __build_speaker_index(people):
+        # Maps every label and alternative label to the person's attributes.
+        # The first person in the list wins, which is the same precedence as scanning the list in order
+        speaker_index = {}
+        for person in people:
+            person_attributes = person["attributes"]
+            speaker_index.setdefault(person_attributes["label"], person_attributes)
+            for label_alternative in person_attributes["labelAlternative"]:
+                speaker_index.setdefault(label_alternative, person_attributes)
+        return speaker_index
+
+    @staticmethod
+    def __resolve_speaker(speaker_index, sentence_speaker):
+        if sentence_speaker is None or sentence_speaker not in speaker_index:
+            return None, None
+        person_attributes = speaker_index[sentence_speaker]
+        return person_attributes["party"]["label"], person_attributes["faction"]["label"]
+
+    def analyse_sentiment(self, sentiment_model, batch_size=DEFAULT_BATCH_SIZE, sentiment_cache=None,
+                          summary_only=False):
+        # With summary_only only the sentences generate_summary uses are scored, the other rows stay None
+        sentence_results = predict_sentences(
+            sentiment_model, self.get_sentences_to_score(summary_only), batch_size, sentiment_cache)
+        self.set_sentiment_results(sentence_results, summary_only)
+
+    def get_sentences_to_score(self, summary_only=False):
+        if summary_only:
+            return self.speech_df["sentence_text"].to_numpy()[get_summary_sentence_mask(self.speech_df)].tolist()
+        return self.speech_df["sentence_text"].tolist()
+
+    def set_sentiment_results(self, sentence_results, summary_only=False):
+        # sentence_results is indexed by sentence text, see sentiment_inference.predict_sentences.
+        # With summary_only the results are only set for the summary sentences, even if another row has the same text
+        speech_results = sentence_results.reindex(
+            self.speech_df["sentence_text"])
+        scored = speech_results["sentence_sentiment_score"].notna().to_numpy()
+        if summary_only:
+            scored = scored & get_summary_sentence_mask(self.speech_df)
+        all_scored = scored.all()
+        for column in SENTIMENT_RESULT_COLUMNS:
+            column_results = speech_results[column] if all_scored else speech_results[column].where(scored)
+            self.speech_df[column] = column_results.to_numpy()
+        self.speech_df["sentence_scored"] = scored
 
     def generate_summary(self):
-        # Need to get the postive, negative, and neutral durations as well as filter by main speaker
-        # First we need to filter the dataframe to only get the mainspeaker's sentence results
-        speech_summary_df = self.speech_df[self.speech_df['sentence_speaker_status']
-                                           == "main-speaker"]
-        if speech_summary_df.empty:
+        # Only the main speaker's sentences are summarised, see speech_summary.generate_speech_summary
+        speech_summary_df = generate_speech_summary(self.speech_df)
+        if speech_summary_df is None:
             print("No main speaker found for speech id " + self.get_id())
             return None
+        return speech_summary_df
 
-        try:
-            speech_metadata = speech_summary_df[["speech_id", "speech_url", "speech_keyword", "speech_duration", "speech_date_start", "speech_date_end",
-                                                 "speech_agenda_item_title", "sentence_speaker", "sentence_speaker_status", "sentence_speaker_party", "sentence_speaker_faction"]].iloc[0]
-        except:
-            print("error parsing speech metadata for speech id " + self.get_id())
-            print(speech_summary_df)
-            raise ValueError(
-                "error parsing speech metadata for speech id " + self.get_id())
-
-        speech_summary_df = speech_summary_df[[
-            "sentence_sentiment_score", "sentence_duration"]]
-
-        speech_summary_df_grouped = speech_summary_df.groupby(
-            ["sentence_sentiment_score"]).sum()
-
-        if "positive" not in speech_summary_df_grouped.index:
-            speech_summary_df_grouped.at["positive", "sentence_duration"] = 0
-        if "negative" not in speech_summary_df_grouped.index:
-            speech_summary_df_grouped.at["negative", "sentence_duration"] = 0
-        if "neutral" not in speech_summary_df_grouped.index:
-            speech_summary_df_grouped.at["neutral", "sentence_duration"] = 0
-
-        speech_summary_df_grouped["percentage"] = speech_summary_df_grouped["sentence_duration"] / \
-            speech_summary_df_grouped["sentence_duration"].sum()
-
-        try:
-            speech_negative_duration = speech_summary_df_grouped.at["negative",
-                                                                    "sentence_duration"]
-            speech_negative_percentage = speech_summary_df_grouped.at["negative",
-                                                                      "percentage"]
-            speech_neutral_duration = speech_summary_df_grouped.at["neutral",
-                                                                   "sentence_duration"]
-            speech_neutral_percentage = speech_summary_df_grouped.at["neutral",
-                                                                     "percentage"]
-            speech_positive_duration = speech_summary_df_grouped.at["positive",
-                                                                    "sentence_duration"]
-            speech_positive_percentage = speech_summary_df_grouped.at["positive",
-                                                                      "percentage"]
-        except:
-            print("error parsing speech summary for speech id " + self.get_id())
-            print(speech_summary_df_grouped)
-            raise ValueError(
-                "error parsing speech summary for speech id " + self.get_id())
-
-        speech_summary_final_df = pd.DataFrame({
-            "speech_id": speech_metadata["speech_id"],
-            "speech_url": speech_metadata["speech_url"],
-            "speech_duration": speech_metadata["speech_duration"],
-            "speech_keyword": speech_metadata["speech_keyword"],
-            "speech_date_start": speech_metadata["speech_date_start"],
-            "speech_date_end": speech_metadata["speech_date_end"],
-            "speech_agenda_item_title": speech_metadata["speech_agenda_item_title"],
-            "main_speaker": speech_metadata["sentence_speaker"],
-            "main_speaker_party": speech_metadata["sentence_speaker_party"],
-            "main_speaker_faction": speech_metadata["sentence_speaker_faction"],
-            "speech_negative_duration": speech_negative_duration,
-            "speech_negative_percentage": speech_negative_percentage,
-            "speech_neutral_duration": speech_neutral_duration,
-            "speech_neutral_percentage": speech_neutral_percentage,
-            "speech_positive_duration": speech_positive_duration,
-            "speech_positive_percentage": speech_positive_percentage
-        }, index=[0])
-        speech_summary_final_df.set_index("speech_id", inplace=True)
-        return speech_summary_final_df
+    def drop_raw_json(self):
+        # speech_df holds everything that is used after parsing, so the raw json can be released while the
+        # speech waits in the pipeline
+        self.speech_raw_json = None
 
     def get_speech_df(self):
         return self.speech_df
@@ -242,7 +198,12 @@ class Speech:
         self.speech_df.to_csv(filename_with_directory, index=False)
 
     def set_keyword(self, keyword):
-        self.speech_df["speech_keyword"] = keyword
+        self.set_keywords([keyword])
+
+    def set_keywords(self, keywords):
+        # The first keyword is the speech's primary keyword, used to key its summary and partition its output
+        self.speech_df["speech_keyword"] = keywords[0]
+        self.speech_df["speech_keywords"] = KEYWORD_SEPARATOR.join(keywords)
 
     def get_id(self):
         return self.speech_df["speech_id"].iloc[0]
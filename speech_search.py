@@ -0,0 +1,129 @@
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from api_client import API_BASE_URL, get_default_client
+
+
+def get_timestamp_from_datetime(dt):
+    epoch = datetime.utcfromtimestamp(0)
+    return int((dt - epoch).total_seconds() * 1000.0)
+
+
+def get_search_url(query, date_start=None, date_end=None, faction_id=None, api_base_url=API_BASE_URL):
+    base_url = api_base_url + "/search/media"
+    parsed_query = urllib.parse.quote(query)
+    print(parsed_query)
+    query_url = base_url + "?q=" + parsed_query
+    if date_start is not None:
+        date_start_millis = get_timestamp_from_datetime(
+            date_start)
+        date_start_string = str(date_start_millis)
+        query_url += "&dateFrom=" + date_start_string
+    if date_end is not None:
+        date_end_millis = get_timestamp_from_datetime(
+            date_end)
+        date_end_string = str(date_end_millis)
+        query_url += "&dateTo=" + date_end_string
+    if faction_id is not None:
+        query_url += "&factionID=" + urllib.parse.quote(faction_id)
+    print(query_url)
+    return query_url
+
+
+def get_next_page_url(speeches_raw_json):
+    # The search api links to the next page of results, the last page has no next link
+    links = speeches_raw_json.get("links")
+    if not isinstance(links, dict):
+        return None
+    return links.get("next")
+
+
+def iter_search_results(query, limit=None, date_start=None, date_end=None, faction_id=None, api_client=None,
+                        prefetch=True, first_page_raw_json=None):
+    # Yields the raw json of each speech in the search results, formatted like a media api response.
+    # No further pages are fetched once limit speeches have been yielded.
+    # With prefetch the next page is downloaded while the caller is still working on the current one
+    if api_client is None:
+        api_client = get_default_client()
+
+    speeches_raw_json = first_page_raw_json
+    if speeches_raw_json is None:
+        query_url = get_search_url(
+            query, date_start, date_end, faction_id, api_client.api_base_url)
+        speeches_raw_json = api_client.get_json(query_url)
+
+    if "data" not in speeches_raw_json:
+        print("No speeches found for query " + query)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    current_speech = 0
+    try:
+        while speeches_raw_json is not None:
+            page_data = speeches_raw_json.get("data") or []
+            next_page_url = get_next_page_url(speeches_raw_json)
+
+            # Only go to the next page if this one does not already reach the limit
+            needs_next_page = next_page_url is not None and len(page_data) != 0 and \
+                (limit is None or current_speech + len(page_data) < limit)
+            next_page = None
+            if needs_next_page and executor is not None:
+                next_page = executor.submit(api_client.get_json, next_page_url)
+
+            for speech_data in page_data:
+                if limit is not None and current_speech >= limit:
+                    return
+                current_speech += 1
+                speech_data_formatted = {}
+                speech_data_formatted["data"] = speech_data
+                yield speech_data_formatted
+
+            if not needs_next_page:
+                speeches_raw_json = None
+            elif next_page is not None:
+                speeches_raw_json = next_page.result()
+            else:
+                speeches_raw_json = api_client.get_json(next_page_url)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_speeches_by_query(query, limit=None, date_start=None, date_end=None, faction_id=None, api_client=None,
+                           prefetch=True, first_page_raw_json=None):
+    # Yields speeches lazily page by page, see iter_search_results
+    # Imported here so fetching raw json does not load pandas
+    from speech import Speech
+    for speech_raw_json in iter_search_results(query, limit, date_start, date_end, faction_id, api_client,
+                                               prefetch, first_page_raw_json):
+        speech = Speech(speech_raw_json=speech_raw_json)
+        speech.set_keyword(query)
+        yield speech
+
+
+def get_speeches_by_query(query, limit=None, date_start=None, date_end=None, faction_id=None, api_client=None):
+    return list(iter_speeches_by_query(query, limit, date_start, date_end, faction_id, api_client))
+
+
+def get_speeches_by_queries(queries, limit=None, date_start=None, date_end=None, api_client=None, window_days=None):
+    # queries is a list of (keyword, faction_id) pairs. Every speech is returned once, with all the keywords that
+    # found it, in the order the speeches were first found, see crawl_planner.CrawlPlanner
+    from crawl_planner import CrawlPlanner, get_media_id
+    from speech import Speech
+    crawl_planner = CrawlPlanner(
+        queries, limit, date_start, date_end, window_days, api_client)
+    speeches = [(get_media_id(speech_raw_json), Speech(speech_raw_json=speech_raw_json))
+                for _, speech_raw_json in crawl_planner.iter_speeches()]
+    # The keywords are only complete once the whole crawl has been read
+    for media_id, speech in speeches:
+        speech.set_keywords(crawl_planner.get_keywords(media_id))
+    return [speech for _, speech in speeches]
+
+
+def get_speeches_by_urls(urls, api_client=None):
+    # Fetches the media documents concurrently, e.g. for the urls in speeches.py
+    from speech import Speech
+    if api_client is None:
+        api_client = get_default_client()
+    return [Speech(speech_raw_json=speech_raw_json) for speech_raw_json in api_client.get_json_many(urls)]
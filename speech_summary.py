@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+# A speech is identified by its id and keyword, the same speech can be returned for several keywords
+SPEECH_KEY_COLUMNS = ["speech_id", "speech_keyword"]
+
+# The sentence columns generate_summaries needs, other columns can be dropped before building the corpus table
+SUMMARY_INPUT_COLUMNS = ["speech_id", "speech_url", "speech_keyword", "speech_keywords", "speech_duration",
+                         "speech_date_start", "speech_date_end", "speech_agenda_item_title", "sentence_speaker",
+                         "sentence_speaker_status", "sentence_speaker_party", "sentence_speaker_faction",
+                         "sentence_type", "sentence_sentiment_score", "sentence_duration"]
+
+# One row per speech. speech_keyword is only the primary keyword, the first that found the speech, speech_keywords
+# lists every keyword that found it, split it to count a speech under each of its keywords
+SUMMARY_COLUMNS = ["speech_id", "speech_url", "speech_duration", "speech_keyword", "speech_keywords",
+                   "speech_date_start", "speech_date_end", "speech_agenda_item_title", "main_speaker",
+                   "main_speaker_party", "main_speaker_faction", "speech_negative_duration",
+                   "speech_negative_percentage", "speech_neutral_duration", "speech_neutral_percentage",
+                   "speech_positive_duration", "speech_positive_percentage"]
+
+SENTIMENT_SCORES = ["negative", "neutral", "positive"]
+
+
+def get_summary_sentence_mask(sentences_df):
+    # The sentences a summary is built from, the main speaker's speech without comments or interjections.
+    # Only these need a sentiment score in summary only mode, see sentiment_inference.analyse_speeches_sentiment
+    # Compared as numpy arrays, which is several times faster than comparing the columns for small frames
+    return (sentences_df["sentence_speaker_status"].to_numpy() == "main-speaker") & \
+        (sentences_df["sentence_type"].to_numpy() == "speech")
+
+
+def get_main_speaker_sentences(sentences_df):
+    return sentences_df[get_summary_sentence_mask(sentences_df)]
+
+
+def generate_summaries(sentences_df):
+    # Summarises every speech in a table of sentences from any number of speeches, with the same schema as
+    # Speech.generate_summary. Speeches without a main speaker have no main speaker sentences and are left out
+    main_speaker_sentences = get_main_speaker_sentences(sentences_df)
+
+    # The metadata of a speech is taken from its first main speaker sentence
+    speech_metadata = main_speaker_sentences.drop_duplicates(
+        SPEECH_KEY_COLUMNS).set_index(SPEECH_KEY_COLUMNS)
+
+    # One row per speech and one column per sentiment score with the summed sentence durations
+    sentiment_durations = main_speaker_sentences.groupby(
+        SPEECH_KEY_COLUMNS + ["sentence_sentiment_score"], sort=False, dropna=False)["sentence_duration"].sum()
+    sentiment_durations = sentiment_durations.unstack("sentence_sentiment_score").reindex(
+        index=speech_metadata.index, columns=SENTIMENT_SCORES).fillna(0).astype(float)
+
+    total_durations = sentiment_durations.sum(axis=1)
+
+    speech_summaries_df = pd.DataFrame({
+        "speech_url": speech_metadata["speech_url"],
+        "speech_duration": speech_metadata["speech_duration"],
+        "speech_keywords": speech_metadata["speech_keywords"],
+        "speech_date_start": speech_metadata["speech_date_start"],
+        "speech_date_end": speech_metadata["speech_date_end"],
+        "speech_agenda_item_title": speech_metadata["speech_agenda_item_title"],
+        "main_speaker": speech_metadata["sentence_speaker"],
+        "main_speaker_party": speech_metadata["sentence_speaker_party"],
+        "main_speaker_faction": speech_metadata["sentence_speaker_faction"]
+    }, index=speech_metadata.index)
+    for sentiment_score in SENTIMENT_SCORES:
+        speech_summaries_df["speech_" + sentiment_score +
+                            "_duration"] = sentiment_durations[sentiment_score]
+        speech_summaries_df["speech_" + sentiment_score + "_percentage"] = \
+            sentiment_durations[sentiment_score] / total_durations
+
+    speech_summaries_df = speech_summaries_df.reset_index()[SUMMARY_COLUMNS]
+    return speech_summaries_df.set_index("speech_id")
+
+
+def generate_speech_summary(sentences_df):
+    # Summarises the sentences of a single speech, with the same result as generate_summaries. Works on numpy
+    # arrays instead of grouping, which is several times faster for one speech. Returns None for speeches without
+    # a main speaker
+    main_speaker_mask = get_summary_sentence_mask(sentences_df)
+    if not main_speaker_mask.any():
+        return None
+
+    # The metadata of the speech is taken from its first main speaker sentence, as a one row frame so the column
+    # types are the same as in generate_summaries
+    speech_summary_df = sentences_df.iloc[[main_speaker_mask.argmax()]][[
+        "speech_id", "speech_url", "speech_duration", "speech_keyword", "speech_keywords", "speech_date_start",
+        "speech_date_end", "speech_agenda_item_title", "sentence_speaker", "sentence_speaker_party",
+        "sentence_speaker_faction"]].rename(columns={"sentence_speaker": "main_speaker",
+                                                     "sentence_speaker_party": "main_speaker_party",
+                                                     "sentence_speaker_faction": "main_speaker_faction"})
+
+    sentiment_scores = sentences_df["sentence_sentiment_score"].to_numpy()[main_speaker_mask]
+    sentence_durations = sentences_df["sentence_duration"].to_numpy(dtype=float)[main_speaker_mask]
+    sentiment_durations = {sentiment_score: sentence_durations[sentiment_scores == sentiment_score].sum()
+                           for sentiment_score in SENTIMENT_SCORES}
+    total_duration = sum(sentiment_durations.values())
+    with np.errstate(invalid="ignore"):
+        for sentiment_score in SENTIMENT_SCORES:
+            speech_summary_df["speech_" + sentiment_score + "_duration"] = sentiment_durations[sentiment_score]
+            speech_summary_df["speech_" + sentiment_score + "_percentage"] = \
+                sentiment_durations[sentiment_score] / total_duration
+    return speech_summary_df[SUMMARY_COLUMNS].set_index("speech_id")